@@ -8,12 +8,16 @@ PROJECT_ROOT = Path(__file__).resolve().parents[2]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from src.kernel import BDDSeqSim
+from src.kernel import BDDSeqSim, BDDSupportSim
 
 OUT_DIR = PROJECT_ROOT / "ae" / "results"
 
 
-def run_table4(n: int, ks, r: int = 3):
+def run_table4(n: int, ks, r: int = 3, symbolic: bool = False, support: bool = False):
+    if support:
+        return run_table4_support(n, ks, r)
+    if symbolic:
+        return run_table4_symbolic(n, ks, r)
     rows = []
     for k in ks:
         Sim = BDDSeqSim(n, n - 1, r)
@@ -47,11 +51,83 @@ def run_table4(n: int, ks, r: int = 3):
     return rows
 
 
+def run_table4_symbolic(n: int, ks, r: int = 3):
+    # One simulation of max(ks) iterations with symbolic outcomes; every k is then a query on it
+    Sim = BDDSeqSim(n, n - 1, r)
+    Sim.init_stored_state_by_basis(0)
+
+    rows = []
+    t0 = time.time()
+    for it in range(1, max(ks) + 1):
+        Sim.init_input_state_by_basis(0)
+        Sim.init_comb_bdd()
+        Sim.H(1)
+        Sim.cwalk(1, list(range(2, n)))
+        Sim.multi_controlled_X(list(range(1, n)), 0)
+        Sim.measure_symbolic()
+        if it in ks:
+            # pattern 0^(k-1) 1; the later outcomes are summed over
+            prob = Sim.sequence_prob([[0]] * (it - 1) + [[1]])
+            t1 = time.time()
+            rows.append(
+                {
+                    "qubits": n,
+                    "k": it,
+                    "reachable": "Yes" if prob > 0.0 else "No",
+                    "probability": f"{prob}",
+                    "time_seconds": f"{(t1 - t0):.6f}",
+                }
+            )
+    return sorted(rows, key=lambda row: ks.index(row["k"]))
+
+
+def run_table4_support(n: int, ks, r: int = 3):
+    # Screening pass on the support only (qubit 0 is the input qubit, re-prepared in |0> after each measurement);
+    # the exact kernel is run only for the k the support cannot decide
+    Sim = BDDSupportSim(n)
+    Sim.init_basis_state(0)
+
+    rows = []
+    t0 = time.time()
+    for it in range(1, max(ks) + 1):
+        Sim.H(1)
+        Sim.cwalk(1, list(range(2, n)))
+        Sim.multi_controlled_X(list(range(1, n)), 0)
+        if it in ks:
+            # pattern 0^(it-1) 1
+            possible = Sim.possible([0], [1])
+            t1 = time.time()
+            if possible and not Sim.exact:
+                row = run_table4(n, [it], r)[0]
+                row["decided_by"] = "exact"
+                rows.append(row)
+                continue
+            rows.append(
+                {
+                    "qubits": n,
+                    "k": it,
+                    "reachable": "Yes" if possible else "No",
+                    "probability": "" if possible else "0.0",
+                    "time_seconds": f"{(t1 - t0):.6f}",
+                    "decided_by": "support",
+                }
+            )
+        Sim.mid_measure([0], [0])
+        Sim.reset(0)
+    return sorted(rows, key=lambda row: ks.index(row["k"]))
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--smoke", action="store_true", help="Run a small subset for quick sanity check")
     ap.add_argument("--n", type=int, default=256, help="Number of qubits (default 256)")
     ap.add_argument("--k", type=str, default="", help="Comma-separated k list, e.g. 1,3,7 (overrides default)")
+    ap.add_argument("--symbolic", action="store_true",
+                    help="Keep outcomes as BDD variables: one simulation of max(k) iterations answers every k "
+                         "(time_seconds is then cumulative)")
+    ap.add_argument("--support", action="store_true",
+                    help="Screen on the state's support only; the exact kernel runs only for k it cannot decide "
+                         "(support-decided rows have time_seconds cumulative and no probability)")
     args = ap.parse_args()
 
     if args.k.strip():
@@ -63,7 +139,7 @@ def main():
         ks = [1, 2]
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
-    rows = run_table4(n=args.n, ks=ks)
+    rows = run_table4(n=args.n, ks=ks, symbolic=args.symbolic, support=args.support)
 
     out_csv = OUT_DIR / "table4.csv"
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
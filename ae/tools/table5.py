@@ -16,10 +16,10 @@ from src.simulator import BDDSimulator
 OUT_DIR = PROJECT_ROOT / "ae" / "results"
 
 
-def run_table5(k_max: int, repeat_runs: int):
+def run_table5(k_max: int, repeat_runs: int, state_cache: int = 0):
     parser = QiskitParser(circ)
     structure = parser.parse()
-    sim = BDDSimulator(structure)
+    sim = BDDSimulator(structure, cache_size=state_cache)
 
     rows = []
     cumulative = 0.0
@@ -57,6 +57,8 @@ def main():
     ap.add_argument("--smoke", action="store_true", help="Run a small subset for quick sanity check")
     ap.add_argument("--k-max", type=int, default=8, help="Max k (default 8, i.e., k=0..8)")
     ap.add_argument("--repeat-runs", type=int, default=5, help="Repeats per k for averaging (default 5)")
+    ap.add_argument("--state-cache", type=int, default=0,
+                    help="Cache up to N states by outcome history, so run k resumes from run k-1 (default 0, off)")
     args = ap.parse_args()
 
     # Smoke defaults: very fast, still checks preset-path probability plumbing
@@ -67,7 +69,7 @@ def main():
             args.repeat_runs = 3
 
     OUT_DIR.mkdir(parents=True, exist_ok=True)
-    rows = run_table5(k_max=args.k_max, repeat_runs=args.repeat_runs)
+    rows = run_table5(k_max=args.k_max, repeat_runs=args.repeat_runs, state_cache=args.state_cache)
 
     out_csv = OUT_DIR / "table5.csv"
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
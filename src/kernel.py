@@ -1,5 +1,9 @@
 from math import ceil, log2, sqrt, pi, isclose
+from bisect import bisect_left, bisect_right
 import cmath as cm
+import random
+import copy
+import numpy as np
 from dd import cudd as _bdd
 from fractions import Fraction
 from decimal import Decimal, getcontext  # <--- Must import decimal
@@ -10,9 +14,17 @@ from decimal import Decimal, getcontext  # <--- Must import decimal
 getcontext().prec = 150
 
 class BDDCombSim:
-    def __init__(self, n, r):
-        self.BDD = _bdd.BDD()
-        self.BDD.configure(reordering=True)
+    def __init__(self, n, r, manager=None):
+        """
+            n represents the number of qubits
+            r represents the initial number of slices
+            manager: an existing BDD manager to share (e.g., with BDDSeqSim); a new one is created if None
+        """
+        if manager is None:
+            self.BDD = _bdd.BDD()
+            self.BDD.configure(reordering=True)
+        else:
+            self.BDD = manager
         self.n = n
         self.r = r
         for i in range(self.n):
@@ -27,123 +39,194 @@ class BDDCombSim:
             self.Fc.append(self.BDD.false)
             self.Fd.append(self.BDD.false)
         self.k = 0
+        # Exact squared norm (term_int, term_sqrt, k), i.e., (term_int + sqrt(2) * term_sqrt) / 2^k.
+        # Unitary gates keep it; measurements update it; None means unknown (recomputed on demand).
+        self.norm = (0, 0, 0)
+        # Non-qubit variables the slices may depend on (e.g. symbolic outcomes of BDDSeqSim.measure_symbolic).
+        # They are summed over like free qubits, so probabilities are marginals over them.
+        self.outcome_vars = []
+        # Input variables of a basis-state family (init_basis_family), also counted as free; see for_input
+        self.input_vars = []
 
     def init_basis_state(self, basis):
         assert basis < (1 << self.n), "Basis state is out of range!"
         tmp = dict()
         for i in range(self.n):
             tmp['q%d' % i] = bool((basis >> (self.n - 1 - i)) & 1)
+        # Also valid on a used (e.g., forked) simulator: all other slices are cleared
+        self.Fa, self.Fb, self.Fc, self.Fd = ([self.BDD.false] * self.r for _ in range(4))
         self.Fd[0] = self.BDD.cube(tmp)
+        self.k = 0
+        self.norm = None
+        self.input_vars = []
+        # Minimal width; adders grow it on carry-out
+        self.simplify_overflow()
+
+    def init_basis_family(self, qubits, basis=0):
+        """
+        [Symbolic input family]
+        Starts from every basis state that agrees with `basis` outside `qubits` at once: qubit q in `qubits` is
+        tied to a fresh input variable x<q>, i.e. the slices hold sum_x |x> over the 2^len(qubits) inputs.
+        Gates act on every input alike; measurements collapse without renormalising, so for_input(value) later
+        gives each input's own (unnormalized) state. Counting sums over the input variables like free qubits (the
+        family's norm is 2^len(qubits)), so normalized probabilities are those of a uniformly random input.
+        """
+        self.init_basis_state(basis)
+        self.input_vars = ['x%d' % q for q in qubits]
+        cube = self.Fd[0]
+        for q, v in zip(qubits, self.input_vars):
+            self.BDD.add_var(v)
+            bit = self.BDD.var('q%d' % q)
+            cube = self.BDD.exist(['q%d' % q], cube) & ~self.BDD.apply('^', bit, self.BDD.var(v))
+        self.Fd[0] = cube
+
+    def for_input(self, value):
+        """
+        The member of the family for one input: a fork with the input variables set to the bits of `value`
+        (the first qubit given to init_basis_family is the highest bit).
+        """
+        l = len(self.input_vars)
+        assert value < (1 << l), "Input is out of range!"
+        d = {v: bool((value >> (l - 1 - i)) & 1) for i, v in enumerate(self.input_vars)}
+        member = self.fork()
+        member.Fa = [self.BDD.let(d, f) for f in self.Fa]
+        member.Fb = [self.BDD.let(d, f) for f in self.Fb]
+        member.Fc = [self.BDD.let(d, f) for f in self.Fc]
+        member.Fd = [self.BDD.let(d, f) for f in self.Fd]
+        member.input_vars = []
+        member.norm = None
+        return member
+
+    def snapshot(self):
+        """
+        Captures the state as (Fa, Fb, Fc, Fd, r, k, norm, outcome_vars, input_vars) with the slices as tuples of
+        node references. BDD nodes are immutable, so this is O(r) and the snapshot stays valid while the state evolves.
+        """
+        return (tuple(self.Fa), tuple(self.Fb), tuple(self.Fc), tuple(self.Fd), self.r, self.k, self.norm,
+                tuple(self.outcome_vars), tuple(self.input_vars))
+
+    def restore(self, state):
+        """
+        Resets to a snapshot taken from a simulator on the same manager.
+        """
+        fa, fb, fc, fd, self.r, self.k, self.norm, outcome_vars, input_vars = state
+        self.Fa, self.Fb, self.Fc, self.Fd = list(fa), list(fb), list(fc), list(fd)
+        self.outcome_vars, self.input_vars = list(outcome_vars), list(input_vars)
+
+    def fork(self):
+        """
+        Independent copy of this simulator in the same manager; all nodes are shared.
+        """
+        twin = copy.copy(self)
+        twin.restore(self.snapshot())
+        return twin
 
     def Car(self, A, B, C):
-        return self.BDD.add_expr(r'({A} & {B}) | (({A} | {B}) & {C})'.format(A=A, B=B, C=C))
+        return (A & B) | ((A | B) & C)
 
     def Sum(self, A, B, C):
-        return self.BDD.add_expr(r'{A} ^ {B} ^ {C}'.format(A=A, B=B, C=C))
+        return self.BDD.apply('^', self.BDD.apply('^', A, B), C)
+
+    def _ripple_add(self, A, B, cin):
+        """
+        Bit-sliced ripple-carry adder working directly on BDD nodes.
+        A, B: lists of r slices (two's complement, LSB first); B = None means B == 0 (incrementer).
+        cin: carry-in BDD of the lowest slice.
+        Returns r + 1 slices, the top one being the sign-extended sum.
+        """
+        r = len(A)
+        C = cin
+        tmpx = []
+        if B is None:
+            # Half-adder path: Car(A, false, C) = A & C, Sum(A, false, C) = A ^ C
+            for i in range(r):
+                tmpx.append(self.BDD.apply('^', A[i], C))
+                C = A[i] & C
+            tmpx.append(self.BDD.apply('^', A[r - 1], C))
+        else:
+            for i in range(r):
+                tmpx.append(self.Sum(A[i], B[i], C))
+                C = self.Car(A[i], B[i], C)
+            tmpx.append(self.Sum(A[r - 1], B[r - 1], C))
+        return tmpx
+
+    def _add_to_all(self, g, d, cin):
+        """
+        Applies the same adder to Fa/Fb/Fc/Fd: F <- g(F) + d(F) + cin, slice by slice.
+        d = None selects the half-adder (incrementer) path.
+        """
+        def trans(x):
+            # Gates are linear in each component, so a zero component stays zero
+            if not self._live(x):
+                return [self.BDD.false] * (len(x) + 1)
+            return self._ripple_add([g(f) for f in x], None if d is None else [d(f) for f in x], cin)
+
+        self.Fa = trans(self.Fa)
+        self.Fb = trans(self.Fb)
+        self.Fc = trans(self.Fc)
+        self.Fd = trans(self.Fd)
+
+    def _live(self, x):
+        # Components with all slices false (e.g. Fa, Fb, Fc of real-amplitude circuits) are skipped by the gates
+        false = self.BDD.false
+        return any(f != false for f in x)
+
+    def _apply_to_live(self, trans):
+        for x in (self.Fa, self.Fb, self.Fc, self.Fd):
+            if self._live(x):
+                x[:] = [trans(f) for f in x]
 
     def X(self, target):
-        r = len(self.Fd)
         trans = lambda x: (self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.false}, x)) | (
                 ~self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.true}, x))
-        for i in range(r):
-            self.Fa[i] = trans(self.Fa[i])
-            self.Fb[i] = trans(self.Fb[i])
-            self.Fc[i] = trans(self.Fc[i])
-            self.Fd[i] = trans(self.Fd[i])
+        self._apply_to_live(trans)
         self.simplify_tail()
 
     def Y(self, target):
-        r = len(self.Fd)
-        g = lambda x: (self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.false}, x)) | (
-                ~self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.true}, x))
-        d1 = lambda x: (self.BDD.var('q%d' % target) & x) | (~self.BDD.var('q%d' % target) & ~x)
-        d2 = lambda x: (self.BDD.var('q%d' % target) & ~x) | (~self.BDD.var('q%d' % target) & x)
-
-        def trans1(x):
-            Cx = []
-            Cx.append(~self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Dx = d1(g(x[i]))
-                Cx.append(self.Car(Dx, self.BDD.false, Cx[i]))
-                tmpx.append(self.Sum(Dx, self.BDD.false, Cx[i]))
-            tmpx.append(self.Sum(d1(g(x[r - 1])), self.BDD.false, Cx[r]))
-            return tmpx.copy()
-
-        def trans2(x):
-            Cx = []
-            Cx.append(self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Dx = d2(g(x[i]))
-                Cx.append(self.Car(Dx, self.BDD.false, Cx[i]))
-                tmpx.append(self.Sum(Dx, self.BDD.false, Cx[i]))
-            tmpx.append(self.Sum(d2(g(x[r - 1])), self.BDD.false, Cx[r]))
-            return tmpx.copy()
-
-        tmpa = trans1(self.Fc)
-        tmpb = trans1(self.Fd)
-        tmpc = trans2(self.Fa)
-        tmpd = trans2(self.Fb)
-        self.Fa = tmpa.copy()
-        self.Fb = tmpb.copy()
-        self.Fc = tmpc.copy()
-        self.Fd = tmpd.copy()
+        q = self.BDD.var('q%d' % target)
+        g = lambda x: (q & self.BDD.let({'q%d' % target: self.BDD.false}, x)) | (
+                ~q & self.BDD.let({'q%d' % target: self.BDD.true}, x))
+        d1 = lambda x: (q & x) | (~q & ~x)
+        d2 = lambda x: (q & ~x) | (~q & x)
+
+        def trans(x, d, cin):
+            # Gates are linear in each component, so a zero component stays zero
+            if not self._live(x):
+                return [self.BDD.false] * (len(x) + 1)
+            return self._ripple_add([d(g(f)) for f in x], None, cin)
+
+        tmpa = trans(self.Fc, d1, ~q)
+        tmpb = trans(self.Fd, d1, ~q)
+        tmpc = trans(self.Fa, d2, q)
+        tmpd = trans(self.Fb, d2, q)
+        self.Fa = tmpa
+        self.Fb = tmpb
+        self.Fc = tmpc
+        self.Fd = tmpd
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def Z(self, target):
-        r = len(self.Fd)
-        g = lambda x: (~self.BDD.var('q%d' % target) & x) | (self.BDD.var('q%d' % target) & ~x)
-
-        def trans(x):
-            Cx = []
-            Cx.append(self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Gx = g(x[i])
-                Cx.append(self.Car(Gx, self.BDD.false, Cx[i]))
-                tmpx.append(self.Sum(Gx, self.BDD.false, Cx[i]))
-            tmpx.append(self.Sum(g(x[r - 1]), self.BDD.false, Cx[r]))
-            return tmpx.copy()
-
-        self.Fa = trans(self.Fa)
-        self.Fb = trans(self.Fb)
-        self.Fc = trans(self.Fc)
-        self.Fd = trans(self.Fd)
+        q = self.BDD.var('q%d' % target)
+        g = lambda x: (~q & x) | (q & ~x)
+        self._add_to_all(g, None, q)
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def H(self, target):
-        r = len(self.Fd)
+        q = self.BDD.var('q%d' % target)
         g = lambda x: self.BDD.let({'q%d' % target: self.BDD.false}, x)
-        d = lambda x: (~self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.true}, x)) | (
-                self.BDD.var('q%d' % target) & ~x)
-
-        def trans(x):
-            Cx = []
-            Cx.append(self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Gx = g(x[i])
-                Dx = d(x[i])
-                Cx.append(self.Car(Gx, Dx, Cx[i]))
-                tmpx.append(self.Sum(Gx, Dx, Cx[i]))
-            tmpx.append(self.Sum(g(x[r - 1]), d(x[r - 1]), Cx[r]))
-            return tmpx.copy()
-
-        self.Fa = trans(self.Fa)
-        self.Fb = trans(self.Fb)
-        self.Fc = trans(self.Fc)
-        self.Fd = trans(self.Fd)
+        d = lambda x: (~q & self.BDD.let({'q%d' % target: self.BDD.true}, x)) | (q & ~x)
+        self._add_to_all(g, d, q)
         self.k += 1
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def S(self, target):
         r = len(self.Fd)
-        trans1 = lambda x, y: (~self.BDD.var('q%d' % target) & x) | (self.BDD.var('q%d' % target) & y)
-        g = lambda x, y: (~self.BDD.var('q%d' % target) & x) | (self.BDD.var('q%d' % target) & ~y)
+        q = self.BDD.var('q%d' % target)
+        trans1 = lambda x, y: (~q & x) | (q & y)
+        g = lambda x, y: (~q & x) | (q & ~y)
         tmpa = []
         tmpb = []
         for i in range(r):
@@ -152,28 +235,18 @@ class BDDCombSim:
         tmpa.append(tmpa[-1])
         tmpb.append(tmpb[-1])
 
-        def trans2(x, y):
-            Cx = []
-            Cx.append(self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Gx = g(x[i], y[i])
-                Cx.append(self.Car(Gx, self.BDD.false, Cx[i]))
-                tmpx.append(self.Sum(Gx, self.BDD.false, Cx[i]))
-            tmpx.append(self.Sum(g(x[r - 1], y[r - 1]), self.BDD.false, Cx[r]))
-            return tmpx.copy()
-
-        self.Fc = trans2(self.Fc, self.Fa)
-        self.Fd = trans2(self.Fd, self.Fb)
-        self.Fa = tmpa.copy()
-        self.Fb = tmpb.copy()
+        self.Fc = self._rotate_in(g, self.Fc, self.Fa, q)
+        self.Fd = self._rotate_in(g, self.Fd, self.Fb, q)
+        self.Fa = tmpa
+        self.Fb = tmpb
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def T(self, target):
         r = len(self.Fd)
-        trans1 = lambda x, y: (~self.BDD.var('q%d' % target) & x) | (self.BDD.var('q%d' % target) & y)
-        g = lambda x, y: (~self.BDD.var('q%d' % target) & x) | (self.BDD.var('q%d' % target) & ~y)
+        q = self.BDD.var('q%d' % target)
+        trans1 = lambda x, y: (~q & x) | (q & y)
+        g = lambda x, y: (~q & x) | (q & ~y)
         tmpa = []
         tmpb = []
         tmpc = []
@@ -184,21 +257,20 @@ class BDDCombSim:
         tmpa.append(tmpa[-1])
         tmpb.append(tmpb[-1])
         tmpc.append(tmpc[-1])
-        Cd = []
-        Cd.append(self.BDD.var('q%d' % target))
-        tmpd = []
-        for i in range(r):
-            Gd = g(self.Fd[i], self.Fa[i])
-            Cd.append(self.Car(Gd, self.BDD.false, Cd[i]))
-            tmpd.append(self.Sum(Gd, self.BDD.false, Cd[i]))
-        tmpd.append(self.Sum(g(self.Fd[r - 1], self.Fa[r - 1]), self.BDD.false, Cd[r]))
-        self.Fa = tmpa.copy()
-        self.Fb = tmpb.copy()
-        self.Fc = tmpc.copy()
-        self.Fd = tmpd.copy()
+        tmpd = self._rotate_in(g, self.Fd, self.Fa, q)
+        self.Fa = tmpa
+        self.Fb = tmpb
+        self.Fc = tmpc
+        self.Fd = tmpd
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
+    def _rotate_in(self, g, x, y, q):
+        # S/T: x where q = 0 and -y where q = 1, as g(x, y) + q; zero if both components are
+        if not (self._live(x) or self._live(y)):
+            return [self.BDD.false] * (len(x) + 1)
+        return self._ripple_add([g(a, b) for a, b in zip(x, y)], None, q)
+
     def TDG(self, target):
         self.Z(target)
         self.S(target)
@@ -210,73 +282,43 @@ class BDDCombSim:
 
     def X2P(self, target):
         # Rx(pi/2) gate
-        r = len(self.Fd)
-        d = lambda x: (self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.false}, x)) | (
-                ~self.BDD.var('q%d' % target) & self.BDD.let({'q%d' % target: self.BDD.true}, x))
-
-        def trans1(x, y):
-            Cx = []
-            Cx.append(self.BDD.true)
-            tmpx = []
-            for i in range(r):
-                Dx = d(x[i])
-                Cx.append(self.Car(y[i], ~Dx, Cx[i]))
-                tmpx.append(self.Sum(y[i], ~Dx, Cx[i]))
-            tmpx.append(self.Sum(y[r - 1], ~d(x[r - 1]), Cx[r]))
-            return tmpx.copy()
-
-        def trans2(x, y):
-            Cx = []
-            Cx.append(self.BDD.false)
-            tmpx = []
-            for i in range(r):
-                Dx = d(x[i])
-                Cx.append(self.Car(y[i], Dx, Cx[i]))
-                tmpx.append(self.Sum(y[i], Dx, Cx[i]))
-            tmpx.append(self.Sum(y[r - 1], d(x[r - 1]), Cx[r]))
-            return tmpx.copy()
-
-        tmpa = trans1(self.Fc, self.Fa)
-        tmpb = trans1(self.Fd, self.Fb)
-        tmpc = trans2(self.Fa, self.Fc)
-        tmpd = trans2(self.Fb, self.Fd)
-        self.Fa = tmpa.copy()
-        self.Fb = tmpb.copy()
-        self.Fc = tmpc.copy()
-        self.Fd = tmpd.copy()
+        q = self.BDD.var('q%d' % target)
+        d = lambda x: (q & self.BDD.let({'q%d' % target: self.BDD.false}, x)) | (
+                ~q & self.BDD.let({'q%d' % target: self.BDD.true}, x))
+
+
+        def trans(x, y, negate):
+            # x - d(y) (as x + ~d(y) + 1) or x + d(y), skipping zero components
+            if not self._live(y):
+                return x + [x[-1]]
+            ys = [~d(f) for f in y] if negate else [d(f) for f in y]
+            if not self._live(x):
+                return self._ripple_add(ys, None, self.BDD.true) if negate else ys + [ys[-1]]
+            return self._ripple_add(x, ys, self.BDD.true if negate else self.BDD.false)
+
+        tmpa = trans(self.Fa, self.Fc, True)
+        tmpb = trans(self.Fb, self.Fd, True)
+        tmpc = trans(self.Fc, self.Fa, False)
+        tmpd = trans(self.Fd, self.Fb, False)
+        self.Fa = tmpa
+        self.Fb = tmpb
+        self.Fc = tmpc
+        self.Fd = tmpd
         self.k += 1
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def Y2P(self, target):
         # Ry(pi/2) gate
-        r = len(self.Fd)
+        q = self.BDD.var('q%d' % target)
         g = lambda x: self.BDD.let({'q%d' % target: self.BDD.false}, x)
-        d = lambda x: (self.BDD.var('q%d' % target) & x) | (
-                ~self.BDD.var('q%d' % target) & ~self.BDD.let({'q%d' % target: self.BDD.true}, x))
-
-        def trans(x):
-            Cx = []
-            Cx.append(~self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Gx = g(x[i])
-                Dx = d(x[i])
-                Cx.append(self.Car(Gx, Dx, Cx[i]))
-                tmpx.append(self.Sum(Gx, Dx, Cx[i]))
-            tmpx.append(self.Sum(g(x[r - 1]), d(x[r - 1]), Cx[r]))
-            return tmpx.copy()
-
-        self.Fa = trans(self.Fa)
-        self.Fb = trans(self.Fb)
-        self.Fc = trans(self.Fc)
-        self.Fd = trans(self.Fd)
+        d = lambda x: (q & x) | (~q & ~self.BDD.let({'q%d' % target: self.BDD.true}, x))
+        self._add_to_all(g, d, ~q)
         self.k += 1
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def CNOT(self, control, target):
-        r = len(self.Fd)
 
         def trans(x):
             return (~self.BDD.var('q%d' % control) & x) | (
@@ -285,11 +327,7 @@ class BDDCombSim:
                     self.BDD.var('q%d' % control) & ~self.BDD.var('q%d' % target) & self.BDD.let(
                 {'q%d' % control: self.BDD.true, 'q%d' % target: self.BDD.true}, x))
 
-        for i in range(r):
-            self.Fa[i] = trans(self.Fa[i])
-            self.Fb[i] = trans(self.Fb[i])
-            self.Fc[i] = trans(self.Fc[i])
-            self.Fd[i] = trans(self.Fd[i])
+        self._apply_to_live(trans)
         self.simplify_tail()
 
     def SWAP(self, target1, target2):
@@ -298,31 +336,14 @@ class BDDCombSim:
         self.CNOT(target1, target2)
 
     def CZ(self, control, target):
-        r = len(self.Fd)
-        g = lambda x: (~(self.BDD.var('q%d' % control) & self.BDD.var('q%d' % target)) & x) | (
-                self.BDD.var('q%d' % control) & self.BDD.var('q%d' % target) & ~x)
-
-        def trans(x):
-            Cx = []
-            Cx.append(self.BDD.var('q%d' % control) & self.BDD.var('q%d' % target))
-            tmpx = []
-            for i in range(r):
-                Gx = g(x[i])
-                Cx.append(self.Car(Gx, self.BDD.false, Cx[i]))
-                tmpx.append(self.Sum(Gx, self.BDD.false, Cx[i]))
-            tmpx.append(self.Sum(g(x[r - 1]), self.BDD.false, Cx[r]))
-            return tmpx.copy()
-
-        self.Fa = trans(self.Fa)
-        self.Fb = trans(self.Fb)
-        self.Fc = trans(self.Fc)
-        self.Fd = trans(self.Fd)
+        both = self.BDD.var('q%d' % control) & self.BDD.var('q%d' % target)
+        g = lambda x: (~both & x) | (both & ~x)
+        self._add_to_all(g, None, both)
         self.simplify_overflow()  # Overflow
         self.simplify_tail()
 
     def Toffoli(self, control1, control2, target):
         # CCNOT gate
-        r = len(self.Fd)
 
         def trans(x):
             return (~(self.BDD.var('q%d' % control1) & self.BDD.var('q%d' % control2)) & x) | (
@@ -333,16 +354,11 @@ class BDDCombSim:
                 'q%d' % target) & self.BDD.let(
                 {'q%d' % control1: self.BDD.true, 'q%d' % control2: self.BDD.true, 'q%d' % target: self.BDD.true}, x))
 
-        for i in range(r):
-            self.Fa[i] = trans(self.Fa[i])
-            self.Fb[i] = trans(self.Fb[i])
-            self.Fc[i] = trans(self.Fc[i])
-            self.Fd[i] = trans(self.Fd[i])
+        self._apply_to_live(trans)
         self.simplify_tail()
 
     def Fredkin(self, control, target1, target2):
         # CSWAP gate
-        r = len(self.Fd)
 
         def trans(x):
             return (~(self.BDD.var('q%d' % control) & self.BDD.apply('^', self.BDD.var('q%d' % target1),
@@ -355,11 +371,7 @@ class BDDCombSim:
                 'q%d' % target2) & self.BDD.let(
                 {'q%d' % control: self.BDD.true, 'q%d' % target1: self.BDD.true, 'q%d' % target2: self.BDD.false}, x))
 
-        for i in range(r):
-            self.Fa[i] = trans(self.Fa[i])
-            self.Fb[i] = trans(self.Fb[i])
-            self.Fc[i] = trans(self.Fc[i])
-            self.Fd[i] = trans(self.Fd[i])
+        self._apply_to_live(trans)
         self.simplify_tail()
 
     def cwalk(self, control, targets):
@@ -376,7 +388,6 @@ class BDDCombSim:
         controls: list or tuple, containing control qubit indices, e.g., [c1, c2, ..., cn]
         target: int, target qubit index
         """
-        r = len(self.Fd)
 
         def trans(x):
             # 1) Construct "all_controls" representing the AND of all control qubits
@@ -403,11 +414,7 @@ class BDDCombSim:
             )
 
         # 3) Iterate to update self.Fa / self.Fb / self.Fc / self.Fd
-        for i in range(r):
-            self.Fa[i] = trans(self.Fa[i])
-            self.Fb[i] = trans(self.Fb[i])
-            self.Fc[i] = trans(self.Fc[i])
-            self.Fd[i] = trans(self.Fd[i])
+        self._apply_to_live(trans)
 
         self.simplify_tail()
 
@@ -486,6 +493,24 @@ class BDDCombSim:
         Directly constraints Fa/Fb/Fc/Fd based on the basis state, without constructing the huge get_total_bdd.
         Solves the memory explosion problem.
         """
+        self._require_qubit_slices('get_amplitude')
+        return self.coeffs_to_amplitude(self._coeffs_at(cpt_basis))
+
+    def _require_qubit_slices(self, what):
+        # Basis-state views index the slices by the qubits alone; family inputs and recorded outcomes (deferred
+        # mode, BDDSeqSim.measure_symbolic) are further variables that they cannot represent
+        if self.input_vars:
+            raise ValueError("%s is not available on an input family (variables %s); take one member with "
+                             "for_input(value) first" % (what, self.input_vars))
+        if self.outcome_vars:
+            raise ValueError("%s is not available while the state depends on the recorded outcome variables %s "
+                             "(run(mode='deferred') or BDDSeqSim.measure_symbolic); use the outcome distribution or "
+                             "predicate_prob instead" % (what, self.outcome_vars))
+
+    def _coeffs_at(self, cpt_basis):
+        """
+        Exact coefficients (a, b, c, d) of one basis state.
+        """
         # 1. Convert integer basis state (e.g., 5 -> 101) to BDD constraint dictionary
         # Example: {'q0': True, 'q1': False, 'q2': True}
         bool_list = [self.BDD.false, self.BDD.true]
@@ -509,11 +534,7 @@ class BDDCombSim:
         val_c = self._get_value_from_list(restricted_Fc)
         val_d = self._get_value_from_list(restricted_Fd)
 
-        # 4. Combine complex amplitudes
-        w = cm.exp(1j * pi / 4)
-        amplitude = (val_a * w ** 3 + val_b * w ** 2 + val_c * w + val_d) / pow(sqrt(2), self.k)
-
-        return amplitude
+        return val_a, val_b, val_c, val_d
 
 
     def mid_measure(self, target_list, result_list):
@@ -532,19 +553,115 @@ class BDDCombSim:
             self.Fb[i] = self.BDD.let(d, self.Fb[i]) & constraint
             self.Fc[i] = self.BDD.let(d, self.Fc[i]) & constraint
             self.Fd[i] = self.BDD.let(d, self.Fd[i]) & constraint
+        self.norm = None
+        self.simplify_tail()
+
+    def measure_collapse(self, target, result=None):
+        """
+        Fused single-qubit measurement: both branch probabilities and the collapsed state
+        come from the cofactors of the slices.
+        Only the 0-branch is counted, the 1-branch probability is the tracked norm minus it.
+        result: the outcome to collapse to; if None, it is sampled from the exact distribution.
+        Returns (result, branch probability normalized by the current norm).
+        """
+        var = self.BDD.var('q%d' % target)
+        free = [q for q in range(self.n) if q != target]
+        cofactor = lambda val: [[self.BDD.let({'q%d' % target: bool(val)}, f) for f in x]
+                                for x in (self.Fa, self.Fb, self.Fc, self.Fd)]
+        norm_int, norm_sqrt = self._exact_norm()
+        cof = cofactor(0)
+        exact = [self._combine_terms(self._norm_terms(cof, free))]
+        exact.append((norm_int - exact[0][0], norm_sqrt - exact[0][1]))
+        probs = [self._exact_to_prob(*x) for x in exact]
+        current_norm = probs[0] + probs[1]
+        if current_norm == 0.0:
+            raise ValueError("State collapsed to 0 probability.")
+        real_prob_0 = probs[0] / current_norm
+        if result is None:
+            result = 0 if random.random() < real_prob_0 else 1
+        branch_prob = real_prob_0 if result == 0 else (1.0 - real_prob_0)
+
+        if result:
+            cof = cofactor(1)
+        literal = var if result else ~var
+        self.Fa, self.Fb, self.Fc, self.Fd = [[f & literal for f in x] for x in cof]
+        self.norm = (*exact[result], self.k)
         self.simplify_tail()
+        return result, branch_prob
 
     def reset(self, target):
-        r = len(self.Fd)
         trans = lambda x: (~self.BDD.var('q%d' % target)) & (self.BDD.let({'q%d' % target: self.BDD.false}, x) |
                                                              self.BDD.let({'q%d' % target: self.BDD.true}, x))
-        for i in range(r):
-            self.Fa[i] = trans(self.Fa[i])
-            self.Fb[i] = trans(self.Fb[i])
-            self.Fc[i] = trans(self.Fc[i])
-            self.Fd[i] = trans(self.Fd[i])
+        self._apply_to_live(trans)
+        self.norm = None
+        self.simplify_tail()
+
+    def measure_deferred(self, target, name):
+        """
+        [Deferred measurement]
+        Records the outcome of measuring `target` in the fresh variable `name` instead of collapsing: the slices are
+        restricted to q<target> == name, so the state becomes sum_m |m> (x) P_m psi and later gates never mix the
+        two outcomes. The norm is kept; the variable is counted as free from now on (outcome_vars), and
+        predicate_prob gives the probability of any condition on the recorded outcomes.
+        """
+        self.BDD.add_var(name)
+        self.outcome_vars = self.outcome_vars + [name]
+        rel = ~self.BDD.apply('^', self.BDD.var('q%d' % target), self.BDD.var(name))
+        self.Fa = [f & rel for f in self.Fa]
+        self.Fb = [f & rel for f in self.Fb]
+        self.Fc = [f & rel for f in self.Fc]
+        self.Fd = [f & rel for f in self.Fd]
+
+    def restrict(self, cond):
+        """
+        Zeroes every amplitude outside cond (a BDD over the qubit and outcome variables).
+        """
+        self.Fa = [f & cond for f in self.Fa]
+        self.Fb = [f & cond for f in self.Fb]
+        self.Fc = [f & cond for f in self.Fc]
+        self.Fd = [f & cond for f in self.Fd]
+        self.norm = None
+
+    def predicate_prob(self, predicate):
+        """
+        Squared norm of the state restricted to predicate, e.g. the probability that the outcome variables satisfy
+        it (jointly with every outcome already collapsed).
+        """
+        restricted = self.fork()
+        restricted.restrict(predicate)
+        return restricted.get_norm()
+
+    def merge_under(self, cond, state, fixed=None):
+        """
+        Keeps the current amplitudes where cond holds and those of the snapshot `state` (same manager) elsewhere.
+        fixed: a cube conjoined to the snapshot's slices (e.g. outcome variables introduced since it was taken,
+        set to 0). The side with the smaller k is first multiplied by sqrt(2) = w - w^3 as often as needed, which is
+        exact in Z[w].
+        """
+        other = self.fork()
+        other.restore(state)
+        if fixed is not None:
+            other.restrict(fixed)
+        k = max(self.k, other.k)
+        sides = [self._raise_k(x, k) for x in (self, other)]
+        r = max(len(f) for comps in sides for f in comps)
+        sides = [[list(f) + [f[-1]] * (r - len(f)) for f in comps] for comps in sides]
+        ite = lambda x, y: [self.BDD.ite(cond, f, g) for f, g in zip(x, y)]
+        self.Fa, self.Fb, self.Fc, self.Fd = [ite(x, y) for x, y in zip(*sides)]
+        self.r = r
+        self.k = k
+        self.norm = None
+        self.simplify_overflow()
         self.simplify_tail()
 
+    def _raise_k(self, sim, k):
+        # Coefficient functions of sim rescaled to the (larger) k
+        comps = [sim.Fa, sim.Fb, sim.Fc, sim.Fd]
+        dk = k - sim.k
+        if dk % 2:
+            comps = self._scale_coeffs(comps, (-1, 0, 1, 0))
+        return [[self.BDD.false] * (dk // 2) + list(x) for x in comps]
+
     def measure(self, target_list, result_list):
         tmp = target_list.copy()
         print("The probability of measuring qubits %s and getting results %s is %f." % (
@@ -600,25 +717,48 @@ class BDDCombSim:
         all_qubits = set(range(self.n))
         measured_qubits = set(target_list)
         unmeasured_indices = list(all_qubits - measured_qubits)
-        n_vars = len(unmeasured_indices) 
         
-        # 4. Symbolically calculate terms for modulus squared (unchanged)
+        # 4. Calculate all terms for modulus squared in one pass over the shared DAG
         # Returns Python large integers, infinite precision, no overflow
-        aa = self._symbolic_inner_product(res_Fa, res_Fa, n_vars)
-        bb = self._symbolic_inner_product(res_Fb, res_Fb, n_vars)
-        cc = self._symbolic_inner_product(res_Fc, res_Fc, n_vars)
-        dd = self._symbolic_inner_product(res_Fd, res_Fd, n_vars)
-        
-        ab = self._symbolic_inner_product(res_Fa, res_Fb, n_vars)
-        bc = self._symbolic_inner_product(res_Fb, res_Fc, n_vars)
-        cd = self._symbolic_inner_product(res_Fc, res_Fd, n_vars)
-        ad = self._symbolic_inner_product(res_Fa, res_Fd, n_vars)
+        terms = self._norm_terms([res_Fa, res_Fb, res_Fc, res_Fd], unmeasured_indices)
+        return self._exact_to_prob(*self._combine_terms(terms))
+
+    def get_norm(self):
+        """
+        Squared norm of the (unnormalized) state, i.e., the total probability of all outcomes.
+        """
+        return self._exact_to_prob(*self._exact_norm())
+
+    def _exact_norm(self):
+        """
+        Returns the exact squared norm as (term_int, term_sqrt) over the current 2^k.
+        Only counted when unknown, since unitary gates never change it.
+        """
+        if self.norm is None:
+            terms = self._norm_terms([self.Fa, self.Fb, self.Fc, self.Fd], range(self.n))
+            self.norm = (*self._combine_terms(terms), self.k)
+        term_int, term_sqrt, k = self.norm
+        # Rescale to the current k (exact: the value is unchanged by H/X2P/Y2P and simplify_tail)
+        if self.k >= k:
+            return term_int << (self.k - k), term_sqrt << (self.k - k)
+        return term_int >> (k - self.k), term_sqrt >> (k - self.k)
+
+    def _combine_terms(self, terms):
+        """
+        Combines the terms (aa, bb, cc, dd, ab, bc, cd, ad) of _norm_terms into (term_int, term_sqrt).
+        """
+        aa, bb, cc, dd, ab, bc, cd, ad = terms
 
         # 5. Combine results
         # Total = (term_int + sqrt(2) * term_sqrt) / 2^k
         term_int = aa + bb + cc + dd
         term_sqrt = ab + bc + cd - ad
-        
+        return term_int, term_sqrt
+
+    def _exact_to_prob(self, term_int, term_sqrt):
+        """
+        Turns the exact (term_int + sqrt(2) * term_sqrt) / 2^k into a float probability.
+        """
         # =========================================================
         # Core Improvement A: Exact Zero Check
         # =========================================================
@@ -662,54 +802,506 @@ class BDDCombSim:
         # As long as calculation uses Decimal for precision, result is accurate
         return abs(float(total_prob_dec))
 
-    def _symbolic_inner_product(self, list1, list2, n_vars):
+    def _norm_terms(self, slices, free_qubits):
         """
-        Calculates inner product of two integer vector BDDs.
-        Fix NaN issue: Do not pass nvars to count, manually calculate scaling factor.
+        [Single-pass exact counter]
+        slices: [Fa, Fb, Fc, Fd], already restricted on the measured qubits.
+        free_qubits: qubits the slices may still depend on; every other variable is ignored.
+        Returns exact integers (aa, bb, cc, dd, ab, bc, cd, ad), where xy = sum_x value_x(x) * value_y(x).
+        All non-false slices are walked together with a memoised bottom-up traversal, so each node tuple
+        is visited once and no conjunction, float count or support computation is needed.
         """
-        total = 0
-        r = self.r
-        
-        # Pre-compute weights
-        weights = []
-        for i in range(r - 1):
-            weights.append(1 << i)
-        weights.append(-(1 << (r - 1))) 
-
-        for i in range(r):
-            for j in range(r):
-                and_node = list1[i] & list2[j]
-                
-                # If intersection is empty, skip
-                if and_node == self.BDD.false:
+        root, memo, _, used = self._norm_dag(slices, free_qubits)
+        if root is None:
+            return [0] * 8
+        root_dep, total = memo[root]
+        return self._expand_terms([x << root_dep for x in total], used)
+
+    @staticmethod
+    def _expand_terms(vals, used):
+        # Full (aa, bb, cc, dd, ab, bc, cd, ad) from the values of the terms listed in used (the others are 0)
+        out = [0] * 8
+        for t, v in zip(used, vals):
+            out[t] = v
+        return out
+
+    def _norm_dag(self, slices, free_qubits):
+        """
+        The traversal behind _norm_terms, returning its tables: (root, memo, kids, used), where
+        memo[key] = (depth, terms below that depth) and kids[key] = (lo key, hi key) for every inner node tuple.
+        Only the terms listed in used (indices into aa, bb, cc, dd, ab, bc, cd, ad) are carried: a term with a
+        zero component (e.g. all but dd for real-amplitude circuits) is 0. root is None if all slices are false.
+        """
+        r = len(slices[0])
+        weights = [1 << i for i in range(r - 1)] + [-(1 << (r - 1))]
+        true = self.BDD.true
+        false = self.BDD.false
+
+        # Constant-false slices contribute nothing, keep only the others (with their component and weight)
+        active = [(j, weights[i], f) for j, x in enumerate(slices) for i, f in enumerate(x) if f != false]
+        if not active:
+            return None, dict(), dict(), []
+        comps = [j for j, _, _ in active]
+        ws = [w for _, w, _ in active]
+        pairs = [(0, 0), (1, 1), (2, 2), (3, 3), (0, 1), (1, 2), (2, 3), (0, 3)]
+        used = [t for t, (i, j) in enumerate(pairs) if i in comps and j in comps]
+        used_pairs = [pairs[t] for t in used]
+
+        n_free, depth = self._free_depth(free_qubits)
+
+        # Nodes are handled by their integer id; info[id] = (depth, low id, high id), terminals have no children
+        info = dict()
+        nodes = [f for _, _, f in active]
+        while nodes:
+            u = nodes.pop()
+            key = int(u)
+            if key in info:
+                continue
+            if u.var is None:
+                info[key] = (n_free, u == true, None)
+                continue
+            lo, hi = (~u.low, ~u.high) if u.negated else (u.low, u.high)
+            info[key] = (depth[u.level], int(lo), int(hi))
+            nodes.append(lo)
+            nodes.append(hi)
+
+        def leaf(key):
+            # All slices are constants: read the four integer values
+            v = [0, 0, 0, 0]
+            for j, w, u in zip(comps, ws, key):
+                if info[u][1]:
+                    v[j] += w
+            return [v[i] * v[j] for i, j in used_pairs]
+
+        root = tuple(int(f) for _, _, f in active)
+        memo = dict()  # id tuple -> (depth, [the used terms])
+        children = dict()
+        kids = dict()
+        stack = [root]
+        while stack:
+            key = stack[-1]
+            if key in memo:
+                stack.pop()
+                continue
+            if key not in children:
+                infos = [info[u] for u in key]
+                dep = min(x[0] for x in infos)
+                if dep == n_free:
+                    memo[key] = (n_free, leaf(key))
+                    stack.pop()
                     continue
-                
-                # 1. Get Raw Count
-                # Do not pass nvars, let it count satisfied paths for variables actually in BDD
-                # count returns float, must convert to int
-                raw_count = int(self.BDD.count(and_node))
-                
-                # 2. Get Support Size
-                # support returns set of variables actually depended on by the node
-                supp = self.BDD.support(and_node)
-                len_supp = len(supp)
-                
-                # 3. Manually Calculate Scaling Factor
-                # n_vars is the logical number of remaining free qubits
-                # diff is the number of free qubits existing but not used in BDD, each contributes 2x paths
-                diff = n_vars - len_supp
-                
-                # Defensive coding: theoretically diff >= 0. If < 0, logic error, keep original.
-                shift = diff if diff > 0 else 0
-                
-                # Bit shift equivalent to multiplying by 2^shift
-                real_count = raw_count << shift
-                
-                # Accumulate
-                total += weights[i] * weights[j] * real_count
-                    
-        return total
+                lo = tuple(x[1] if x[0] == dep else u for u, x in zip(key, infos))
+                hi = tuple(x[2] if x[0] == dep else u for u, x in zip(key, infos))
+                children[key] = (dep, lo, hi)
+            dep, lo, hi = children[key]
+            pending = [x for x in (lo, hi) if x not in memo]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            kids[key] = (lo, hi)
+            lo_dep, lo_val = memo[lo]
+            hi_dep, hi_val = memo[hi]
+            # Free variables skipped between this node and its children each double the count
+            lo_shift = lo_dep - dep - 1
+            hi_shift = hi_dep - dep - 1
+            memo[key] = (dep, [(x << lo_shift) + (y << hi_shift) for x, y in zip(lo_val, hi_val)])
+
+        return root, memo, kids, used
+
+    def _compress(self, x, y, z, width):
+        """
+        3:2 carry-save compressor: slices (s, c) with x + y + z == s + c (mod 2^width). Each slice is computed on its
+        own, with no carry chain; c is the carry vector shifted up one slice. Only the slices up to the longest input
+        are computed, since above it every input (and so s) repeats its sign slice.
+        """
+        r = max(len(x), len(y), len(z))
+        x, y, z = (list(v) + [v[-1]] * (r - len(v)) for v in (x, y, z))
+        s = [self.Sum(a, b, c) for a, b, c in zip(x, y, z)]
+        c = [self.BDD.false] + [self.Car(a, b, c) for a, b, c in zip(x[:width - 1], y, z)]
+        return s, c
+
+    def _sum_terms(self, terms, const=0):
+        """
+        Slices of const + sum(+-x * 2^shift) over terms = [(x, shift, negative), ...] (two's complement, LSB first).
+        Carry-save: the rows are compressed down to two, shortest first, so carries are propagated only once, by the
+        final ripple add. A negative term enters as its complement, -x * 2^s = ~x * 2^s + 2^s, with 2^s folded into
+        const. Rows are kept modulo 2^width, wide enough for the exact sum.
+        """
+        false = self.BDD.false
+        terms = [(x, s, neg) for x, s, neg in terms if self._live(x)]
+        const += sum(1 << s for _, s, neg in terms if neg)
+        width = (sum(1 << (len(x) - 1 + s) for x, s, _ in terms) + abs(const)).bit_length() + 1
+        rows = [[false] * s + ([~f for f in x] if neg else list(x)) for x, s, neg in terms]
+        # An odd const enters as the carry-in of the final add
+        cin = const & 1
+        const -= cin
+        if const:
+            rows.append([self.BDD.true if const >> i & 1 else false for i in range(const.bit_length() + 1)])
+        while len(rows) > 2:
+            rows.sort(key=len, reverse=True)
+            rows += self._compress(rows.pop(), rows.pop(), rows.pop(), width)
+        rows = [v + [v[-1]] * (width - len(v)) for v in rows] or [[false] * width]
+        if len(rows) == 1 and not cin:
+            return self._trim(rows[0])
+        total = self._ripple_add(rows[0], rows[1] if len(rows) == 2 else None, self.BDD.true if cin else false)
+        return self._trim(total[:width])
+
+    def _scale_coeffs(self, comps, alpha):
+        """
+        Multiplies the coefficient functions comps = (A, B, C, D) by the constant
+        alpha = a * w^3 + b * w^2 + c * w + d, given as (a, b, c, d). Multiplying by w maps (A, B, C, D) to (B, C, D, -A).
+        Each product component is one _sum_terms over the signed, shifted components picked by the bits of alpha.
+        """
+        # w^p * (A, B, C, D) as (component index, negated) pairs
+        rotated = [[(i, False) for i in range(4)]]
+        for _ in range(3):
+            (a, neg), b, c, d = rotated[-1]
+            rotated.append([b, c, d, (a, not neg)])
+        terms = [[], [], [], []]
+        for coef, power in zip(alpha, (3, 2, 1, 0)):
+            for shift in range(abs(coef).bit_length()):
+                if abs(coef) >> shift & 1:
+                    for out, (i, neg) in zip(terms, rotated[power]):
+                        out.append((comps[i], shift, neg != (coef < 0)))
+        return [self._sum_terms(t) for t in terms]
+
+    def _trim(self, x):
+        # Drop redundant sign-extension slices, so equal integers have equal slice lists
+        x = list(x)
+        while len(x) > 1 and x[-1] == x[-2]:
+            x.pop()
+        return x
+
+    def proportional_to(self, state):
+        """
+        Whether the current state equals the snapshot `state` up to a nonzero scalar (global phase, norm and k).
+        Exact: with x a basis state in the snapshot's support, checks S(y) * T(x) == T(y) * S(x) for all y by
+        cross-multiplying the integer coefficient functions in Z[w], so neither k nor the factor needs normalising.
+        """
+        other = self.fork()
+        other.restore(state)
+        if self.nonzero_support() != other.nonzero_support():
+            return False
+        first = next(other.iter_nonzero(), None)
+        if first is None:
+            return True
+        basis, coeffs_other = first
+        mine = (self.Fa, self.Fb, self.Fc, self.Fd)
+        theirs = (other.Fa, other.Fb, other.Fc, other.Fd)
+        lhs = self._scale_coeffs(mine, coeffs_other)
+        rhs = self._scale_coeffs(theirs, self._coeffs_at(basis))
+        return all(self._trim(x) == self._trim(y) for x, y in zip(lhs, rhs))
+
+    def sample_measurements(self, qubits, shots):
+        """
+        [Multi-shot readout]
+        Draws `shots` joint samples of measuring `qubits` on the current state, without collapsing it.
+        Each shot walks the slices top-down, taking branches with the exact subtree weights of the
+        _norm_terms traversal (cached per node tuple). The other qubits are sampled along and dropped,
+        which gives exactly their marginal. Input and outcome variables (families, deferred outcomes) are free
+        levels of the same walk, so they are sampled along too, as get_prob sums over them.
+        Returns a list of outcome tuples, in the order of qubits.
+        """
+        root, memo, kids, used = self._norm_dag([self.Fa, self.Fb, self.Fc, self.Fd], range(self.n))
+        if root is None or self.get_norm() == 0.0:
+            raise ValueError("State collapsed to 0 probability.")
+        # Depth of each qubit among all free levels, numbered as in _norm_dag
+        _, depth = self._free_depth(range(self.n))
+        pos = {q: depth[self.BDD.level_of_var('q%d' % q)] for q in range(self.n)}
+
+        prob_hi = dict()  # node tuple -> probability of taking the high branch
+
+        def branch_prob(key):
+            dep = memo[key][0]
+            lo, hi = kids[key]
+            w = []
+            for child in (lo, hi):
+                child_dep, terms = memo[child]
+                term_int, term_sqrt = self._combine_terms(self._expand_terms(terms, used))
+                shift = child_dep - dep - 1
+                w.append(self._exact_to_prob(term_int << shift, term_sqrt << shift))
+            return w[1] / (w[0] + w[1])
+
+        samples = []
+        for _ in range(shots):
+            chosen = dict()  # depth -> bit, for branching levels; skipped qubits are uniform
+            key = root
+            while key in kids:
+                if key not in prob_hi:
+                    prob_hi[key] = branch_prob(key)
+                bit = 1 if random.random() < prob_hi[key] else 0
+                chosen[memo[key][0]] = bit
+                key = kids[key][bit]
+            samples.append(tuple(chosen[pos[q]] if pos[q] in chosen else random.getrandbits(1) for q in qubits))
+        return samples
   
+    def _free_depth(self, free_qubits):
+        """
+        Returns (n_free, depth), where depth[level] is the number of free qubits strictly above that level.
+        Terminals sit below all free qubits (depth n_free). Outcome variables always count as free.
+        """
+        names = ['q%d' % q for q in free_qubits] + self.outcome_vars + self.input_vars
+        levels = sorted(self.BDD.level_of_var(v) for v in names)
+        return len(levels), {lev: i for i, lev in enumerate(levels)}
+
+    def nonzero_support(self):
+        """
+        BDD of the basis states with nonzero amplitude.
+        An amplitude is zero iff a = b = c = d = 0, and a two's complement value is zero iff all its slices are.
+        """
+        u = self.BDD.false
+        for x in (self.Fa, self.Fb, self.Fc, self.Fd):
+            for f in x:
+                u = u | f
+        return u
+
+    def count_nonzero(self):
+        """
+        Exact number of basis states with nonzero amplitude.
+        """
+        self._require_qubit_slices('count_nonzero')
+        n_free, depth = self._free_depth(range(self.n))
+        root = self.nonzero_support()
+        memo = dict()  # node id -> (depth, number of satisfying assignments below it)
+        stack = [root]
+        while stack:
+            u = stack[-1]
+            key = int(u)
+            if key in memo:
+                stack.pop()
+                continue
+            if u.var is None:
+                memo[key] = (n_free, 1 if u == self.BDD.true else 0)
+                stack.pop()
+                continue
+            lo, hi = (~u.low, ~u.high) if u.negated else (u.low, u.high)
+            pending = [x for x in (lo, hi) if int(x) not in memo]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            dep = depth[u.level]
+            lo_dep, lo_cnt = memo[int(lo)]
+            hi_dep, hi_cnt = memo[int(hi)]
+            memo[key] = (dep, (lo_cnt << (lo_dep - dep - 1)) + (hi_cnt << (hi_dep - dep - 1)))
+        root_dep, total = memo[int(root)]
+        return total << root_dep
+
+    def iter_nonzero(self):
+        """
+        [Sparse enumeration]
+        Yields (basis, (a, b, c, d)) for every basis state with nonzero amplitude, where
+        amplitude = (a * w^3 + b * w^2 + c * w + d) / sqrt(2)^k (see coeffs_to_amplitude).
+        All slices are walked together along the union of their supports, so the cost scales with
+        the number of nonzero amplitudes instead of 2^n. States come in BDD variable order, not sorted.
+        """
+        self._require_qubit_slices('iter_nonzero')
+        r = len(self.Fd)
+        weights = [1 << i for i in range(r - 1)] + [-(1 << (r - 1))]
+        true = self.BDD.true
+        false = self.BDD.false
+        active = [(j, weights[i], f) for j, x in enumerate((self.Fa, self.Fb, self.Fc, self.Fd))
+                  for i, f in enumerate(x) if f != false]
+        if not active:
+            return
+        comps = [j for j, _, _ in active]
+        ws = [w for _, w, _ in active]
+
+        # Visit qubits top-down in the current variable order, so cofactoring is just taking children
+        order = sorted(range(self.n), key=lambda q: self.BDD.level_of_var('q%d' % q))
+        levels = [self.BDD.level_of_var('q%d' % q) for q in order]
+
+        def cofactor(u, lev, val):
+            if u.level != lev:
+                return u
+            child = u.high if val else u.low
+            return ~child if u.negated else child
+
+        stack = [(0, tuple(f for _, _, f in active), 0)]
+        while stack:
+            i, key, basis = stack.pop()
+            if i == self.n:
+                v = [0, 0, 0, 0]
+                for j, w, u in zip(comps, ws, key):
+                    if u == true:
+                        v[j] += w
+                yield basis, tuple(v)
+                continue
+            for val in (1, 0):
+                child = tuple(cofactor(u, levels[i], val) for u in key)
+                if all(u == false for u in child):
+                    continue
+                stack.append((i + 1, child, basis | (val << (self.n - 1 - order[i]))))
+
+    def export_node_table(self):
+        """
+        Flattens all slices into one node table without complement edges.
+        Returns (var, low, high, roots) as NumPy arrays: entry 0 is False and entry 1 is True (var = -1),
+        every other entry tests qubit var[e]; roots[j * r + i] is slice i of component j (a, b, c, d).
+        """
+        self._require_qubit_slices('export_node_table')
+        index = {int(self.BDD.false): 0, int(self.BDD.true): 1}
+        var = [-1, -1]
+        low = [0, 1]
+        high = [0, 1]
+        roots = []
+        for x in (self.Fa, self.Fb, self.Fc, self.Fd):
+            for f in x:
+                stack = [f]
+                while stack:
+                    u = stack[-1]
+                    if int(u) in index:
+                        stack.pop()
+                        continue
+                    lo, hi = (~u.low, ~u.high) if u.negated else (u.low, u.high)
+                    pending = [y for y in (lo, hi) if int(y) not in index]
+                    if pending:
+                        stack.extend(pending)
+                        continue
+                    stack.pop()
+                    index[int(u)] = len(var)
+                    var.append(int(u.var[1:]))
+                    low.append(index[int(lo)])
+                    high.append(index[int(hi)])
+                roots.append(index[int(f)])
+        return np.array(var), np.array(low), np.array(high), np.array(roots)
+
+    def _basis_bits(self, basis_array):
+        """
+        Converts basis states to an (N, n) bool matrix, column i being qubit i (q0 is the highest bit).
+        Accepts an (N, n) 0/1 matrix, or a sequence of integers (Python ints are used beyond 63 qubits).
+        """
+        arr = np.asarray(basis_array)
+        if arr.ndim == 2:
+            assert arr.shape[1] == self.n, "Basis bit matrix must have one column per qubit!"
+            return arr.astype(bool)
+        if self.n <= 63 and arr.dtype != object:
+            arr = arr.astype(np.int64)
+            shifts = np.arange(self.n - 1, -1, -1, dtype=np.int64)
+            return ((arr[:, None] >> shifts[None, :]) & 1).astype(bool)
+        bits = np.zeros((len(arr), self.n), dtype=bool)
+        for row, basis in enumerate(arr):
+            basis = int(basis)
+            for i in range(self.n):
+                bits[row, i] = (basis >> (self.n - 1 - i)) & 1
+        return bits
+
+    def get_amplitudes(self, basis_array):
+        """
+        [Batched get_amplitude]
+        Exports the slices once into a flat node table and evaluates all of them for every basis state
+        with a vectorised NumPy traversal.
+        basis_array: see _basis_bits.
+        Returns (coeffs, amplitudes): coeffs is a (4, N) exact integer array of (a, b, c, d), amplitudes the
+        complex128 array of (a * w^3 + b * w^2 + c * w + d) / sqrt(2)^k.
+        """
+        bits = self._basis_bits(basis_array)
+        num = bits.shape[0]
+        var, low, high, roots = self.export_node_table()
+        r = len(self.Fd)
+        rows = np.arange(num)
+
+        # Value of every slice on every basis state
+        slice_vals = np.empty((len(roots), num), dtype=bool)
+        for s, root in enumerate(roots):
+            cur = np.full(num, root)
+            inner = var[cur] >= 0
+            while inner.any():
+                e = cur[inner]
+                cur[inner] = np.where(bits[rows[inner], var[e]], high[e], low[e])
+                inner = var[cur] >= 0
+            slice_vals[s] = cur == 1
+
+        # Two's complement values; exact Python ints once they no longer fit into int64
+        dtype = np.int64 if r <= 62 else object
+        weights = np.array([1 << i for i in range(r - 1)] + [-(1 << (r - 1))], dtype=dtype)
+        coeffs = np.zeros((4, num), dtype=dtype)
+        for j in range(4):
+            coeffs[j] = weights @ slice_vals[j * r:(j + 1) * r].astype(dtype)
+
+        w = cm.exp(1j * pi / 4)
+        a, b, c, d = (coeffs[j].astype(float) for j in range(4))
+        amplitudes = (a * w ** 3 + b * w ** 2 + c * w + d) / pow(sqrt(2), self.k)
+        return coeffs, amplitudes
+
+    def _fill_truth_table(self, f, out, order):
+        """
+        Writes the truth table of f into the bool array out of shape (2,) * n (axis i = qubit i).
+        order: qubits sorted by level. One recursive expansion over the DAG: a node reached again at
+        the same depth is copied from where it was first written; terminals fill whole subarrays at once.
+        """
+        depth_of = {self.BDD.level_of_var('q%d' % q): d for d, q in enumerate(order)}
+        idx = [slice(None)] * self.n
+        memo = dict()
+
+        def fill(u, d):
+            here = tuple(idx)
+            key = (int(u), d)
+            if key in memo:
+                out[here] = out[memo[key]]
+                return
+            if u.var is None:
+                out[here] = (u == self.BDD.true)
+            else:
+                q = order[d]
+                if depth_of[u.level] > d:
+                    # Qubit q is skipped by u: both halves are equal
+                    idx[q] = 0
+                    fill(u, d + 1)
+                    zero = tuple(idx)
+                    idx[q] = 1
+                    out[tuple(idx)] = out[zero]
+                else:
+                    lo, hi = (~u.low, ~u.high) if u.negated else (u.low, u.high)
+                    idx[q] = 0
+                    fill(lo, d + 1)
+                    idx[q] = 1
+                    fill(hi, d + 1)
+                idx[q] = slice(None)
+            memo[key] = here
+
+        fill(f, 0)
+        # fill refers to itself: without this, self stays in a reference cycle, and collecting it later can free
+        # the BDD manager before the nodes it still holds
+        del fill
+
+    def to_numpy(self, exact=False):
+        """
+        [Dense export] Full state vector as a NumPy array, for small and medium n (up to about 28).
+        Each slice is expanded once into a preallocated truth table and accumulated into the
+        integer coefficient arrays, which are then combined as in get_amplitude.
+        exact: if True, return the exact (4, 2^n) integer array of (a, b, c, d) instead (amplitude
+        = (a * w^3 + b * w^2 + c * w + d) / sqrt(2)^k).
+        Index i of the result is basis state i (q0 is the highest bit).
+        """
+        self._require_qubit_slices('to_numpy')
+        r = len(self.Fd)
+        order = sorted(range(self.n), key=lambda q: self.BDD.level_of_var('q%d' % q))
+        weights = [1 << i for i in range(r - 1)] + [-(1 << (r - 1))]
+        dtype = np.int64 if r <= 62 else object
+        coeffs = np.zeros((4, 1 << self.n), dtype=dtype)
+        buf = np.empty((2,) * self.n, dtype=bool)
+        for j, x in enumerate((self.Fa, self.Fb, self.Fc, self.Fd)):
+            for w, f in zip(weights, x):
+                if f == self.BDD.false:
+                    continue
+                self._fill_truth_table(f, buf, order)
+                np.add(coeffs[j], w, out=coeffs[j], where=buf.reshape(-1))
+        if exact:
+            return coeffs
+        w = cm.exp(1j * pi / 4)
+        a, b, c, d = (coeffs[j].astype(float) for j in range(4))
+        return (a * w ** 3 + b * w ** 2 + c * w + d) / pow(sqrt(2), self.k)
+
+    def coeffs_to_amplitude(self, coeffs):
+        """
+        Combines the exact coefficients (a, b, c, d) into the complex amplitude.
+        """
+        val_a, val_b, val_c, val_d = coeffs
+        w = cm.exp(1j * pi / 4)
+        return (val_a * w ** 3 + val_b * w ** 2 + val_c * w + val_d) / pow(sqrt(2), self.k)
+
     def _get_value_from_list(self, bdd_list):
         """
         [New Helper Function]
@@ -738,22 +1330,29 @@ class BDDCombSim:
             return -final_val - 1
 
     def simplify_tail(self):
-        if self.Fa[0] == self.BDD.false and self.Fb[0] == self.BDD.false and self.Fc[0] == self.BDD.false and self.Fd[
-            0] == self.BDD.false:
-            self.Fa = self.Fa[1:]
-            self.Fb = self.Fb[1:]
-            self.Fc = self.Fc[1:]
-            self.Fd = self.Fd[1:]
-            self.k -= 2
+        # Strips all all-zero low slices at once: each one halves every coefficient (k -= 2)
+        false = self.BDD.false
+        low = 0
+        while (low < len(self.Fd) - 1 and self.k - 2 * low >= 2
+               and all(x[low] == false for x in (self.Fa, self.Fb, self.Fc, self.Fd))):
+            low += 1
+        if low:
+            self.Fa = self.Fa[low:]
+            self.Fb = self.Fb[low:]
+            self.Fc = self.Fc[low:]
+            self.Fd = self.Fd[low:]
+            self.k -= 2 * low
         self.r = len(self.Fd)
 
     def simplify_overflow(self):
-        if self.Fa[-1] == self.Fa[-2] and self.Fb[-1] == self.Fb[-2] and self.Fc[-1] == self.Fc[-2] and self.Fd[-1] == \
-                self.Fd[-2]:
+        # Drops all redundant sign-extension slices at once (two are always kept), so the width only grows when an
+        # adder's carry-out is actually needed
+        while len(self.Fd) > 2 and all(x[-1] == x[-2] for x in (self.Fa, self.Fb, self.Fc, self.Fd)):
             self.Fa.pop()
             self.Fb.pop()
             self.Fc.pop()
             self.Fd.pop()
+        self.r = len(self.Fd)
 
     def signed_extend(self, length):
         for i in range(length):
@@ -781,45 +1380,408 @@ class BDDCombSim:
             print(self.Fd[i].to_expr())
 
     def print_state_vec(self):
-        for i in range(1 << self.n):
-            print("The amplitude of |%s> is" % bin(i)[2:].zfill(self.n), self.get_amplitude(i), end='.\n')
+        # Only nonzero amplitudes, in basis order
+        for i, coeffs in sorted(self.iter_nonzero()):
+            print("The amplitude of |%s> is" % bin(i)[2:].zfill(self.n), self.coeffs_to_amplitude(coeffs), end='.\n')
+
+
+class BDDSupportSim:
+    def __init__(self, n, manager=None):
+        """
+            [Support-only (possibilistic) mode]
+            n represents the number of qubits
+            manager: an existing BDD manager to share (e.g., with a BDDCombSim of the same circuit)
+            Only one Boolean BDD S = self.support over-approximating {x : amplitude(x) != 0} is kept. Permutation
+            gates map S to its image, diagonal gates keep it, measurements cofactor it, and a branching gate
+            (H, X2P, Y2P) on q maps it to (exists q. S). The last is exact unless two members of S differ only in q,
+            whose amplitudes may then cancel; self.exact records whether every step so far was exact, in which
+            case S is the true support.
+        """
+        if manager is None:
+            self.BDD = _bdd.BDD()
+            self.BDD.configure(reordering=True)
+        else:
+            self.BDD = manager
+        self.n = n
+        for i in range(self.n):
+            self.BDD.add_var('q%d' % i)
+        self.support = self.BDD.false
+        self.exact = True
+
+    def init_basis_state(self, basis):
+        assert basis < (1 << self.n), "Basis state is out of range!"
+        tmp = {'q%d' % i: bool((basis >> (self.n - 1 - i)) & 1) for i in range(self.n)}
+        self.support = self.BDD.cube(tmp)
+        self.exact = True
+
+    def init_state_by_bdd(self, sim):
+        # Support of an exact state (a BDDCombSim in the same manager)
+        self.support = sim.nonzero_support()
+        self.exact = True
+
+    def _flip(self, controls, target):
+        # Image of S under X on target, controlled by all of controls
+        q = self.BDD.var('q%d' % target)
+        flipped = (q & self.BDD.let({'q%d' % target: self.BDD.false}, self.support)) | (
+                ~q & self.BDD.let({'q%d' % target: self.BDD.true}, self.support))
+        ctrl = self.BDD.true
+        for c in controls:
+            ctrl &= self.BDD.var('q%d' % c)
+        self.support = (~ctrl & self.support) | (ctrl & flipped)
+
+    def _branch(self, target):
+        name = 'q%d' % target
+        lo = self.BDD.let({name: self.BDD.false}, self.support)
+        hi = self.BDD.let({name: self.BDD.true}, self.support)
+        if lo & hi != self.BDD.false:
+            self.exact = False
+        self.support = lo | hi
+
+    def X(self, target):
+        self._flip([], target)
+
+    def Y(self, target):
+        self._flip([], target)
+
+    def Z(self, target):
+        pass
+
+    def H(self, target):
+        self._branch(target)
+
+    def S(self, target):
+        pass
+
+    def T(self, target):
+        pass
+
+    def TDG(self, target):
+        pass
+
+    def SDG(self, target):
+        pass
+
+    def X2P(self, target):
+        self._branch(target)
+
+    def Y2P(self, target):
+        self._branch(target)
+
+    def CNOT(self, control, target):
+        self._flip([control], target)
+
+    def SWAP(self, target1, target2):
+        self.CNOT(target1, target2)
+        self.CNOT(target2, target1)
+        self.CNOT(target1, target2)
+
+    def CZ(self, control, target):
+        pass
+
+    def Toffoli(self, control1, control2, target):
+        self._flip([control1, control2], target)
+
+    def Fredkin(self, control, target1, target2):
+        self.CNOT(target2, target1)
+        self.Toffoli(control, target1, target2)
+        self.CNOT(target2, target1)
+
+    def cwalk(self, control, targets):
+        self.X(control)
+        for i in range(len(targets)):
+            self.multi_controlled_X([control] + targets[i + 1:], targets[i])
+        self.X(control)
+        for i in range(len(targets) - 1, -1, -1):
+            self.multi_controlled_X([control] + targets[i + 1:], targets[i])
+
+    def multi_controlled_X(self, controls, target):
+        self._flip(controls, target)
+
+    def mid_measure(self, target_list, result_list):
+        self.support &= self.BDD.cube({'q%d' % t: bool(v) for t, v in zip(target_list, result_list)})
+
+    def reset(self, target):
+        self._branch(target)
+        self.support &= ~self.BDD.var('q%d' % target)
+
+    def possible(self, target_list, result_list):
+        """
+        False: the outcome has probability 0 (definitely unreachable). True: it may be reachable, and is (with a
+        nonzero probability) if self.exact; otherwise only the exact kernel can tell.
+        """
+        cube = self.BDD.cube({'q%d' % t: bool(v) for t, v in zip(target_list, result_list)})
+        return self.support & cube != self.BDD.false
+
+
+class _ValueDD:
+    """
+    Exact multi-terminal decision diagram over Z[w], used by BDDSeqSim.compose to multiply operators.
+    A leaf holds the coefficients (a, b, c, d) of a * w^3 + b * w^2 + c * w + d as plain integers, so sums and
+    products act on the leaves instead of rippling carries through the slices of every intermediate function.
+    Nodes are hash-consed integer ids, nodes[u] = (level, lo, hi) or (LEAF, value); levels are the BDD levels
+    when the diagram was built and names[level] the variable there.
+    """
+    LEAF = float('inf')
+
+    def __init__(self, bdd):
+        self.BDD = bdd
+        self.names = dict()
+        self.nodes = []
+        self.unique = dict()
+        self.zero = self.leaf((0, 0, 0, 0))
+        self.add_memo = dict()
+        self.scale_memo = dict()
+
+    def leaf(self, value):
+        key = (self.LEAF, value)
+        if key not in self.unique:
+            self.unique[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self.unique[key]
+
+    def node(self, level, lo, hi):
+        if lo == hi:
+            return lo
+        key = (level, lo, hi)
+        if key not in self.unique:
+            self.unique[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self.unique[key]
+
+    def level(self, u):
+        return self.nodes[u][0]
+
+    def cofactors(self, u, level):
+        entry = self.nodes[u]
+        return (entry[1], entry[2]) if entry[0] == level else (u, u)
+
+    def from_slices(self, comps):
+        """
+        Diagram of the coefficient functions comps = (A, B, C, D), walking all non-false slices together
+        (one diagram node per node tuple, as in _norm_dag).
+        """
+        weights = [[1 << i for i in range(len(x) - 1)] + [-(1 << (len(x) - 1))] for x in comps]
+        active = [(j, w, f) for j, x in enumerate(comps) for w, f in zip(weights[j], x) if f != self.BDD.false]
+        # info[id] = (level, low id, high id) for inner nodes, (LEAF, value) for the terminals
+        info = dict()
+        nodes = [f for _, _, f in active]
+        while nodes:
+            u = nodes.pop()
+            key = int(u)
+            if key in info:
+                continue
+            if u.var is None:
+                info[key] = (self.LEAF, u == self.BDD.true)
+                continue
+            self.names[u.level] = u.var
+            lo, hi = (~u.low, ~u.high) if u.negated else (u.low, u.high)
+            info[key] = (u.level, int(lo), int(hi))
+            nodes.append(lo)
+            nodes.append(hi)
+        flat = [(j, w) for j, w, _ in active]
+        return self._walk(tuple(int(f) for _, _, f in active), flat, info, dict())
+
+    def _walk(self, key, flat, info, memo):
+        if key in memo:
+            return memo[key]
+        entries = [info[u] for u in key]
+        lev = min((x[0] for x in entries), default=self.LEAF)
+        if lev == self.LEAF:
+            value = [0, 0, 0, 0]
+            for (j, w), x in zip(flat, entries):
+                if x[1]:
+                    value[j] += w
+            res = self.leaf(tuple(value))
+        else:
+            lo = tuple(x[1] if x[0] == lev else u for u, x in zip(key, entries))
+            hi = tuple(x[2] if x[0] == lev else u for u, x in zip(key, entries))
+            res = self.node(lev, self._walk(lo, flat, info, memo), self._walk(hi, flat, info, memo))
+        memo[key] = res
+        return res
+
+    def to_slices(self, u):
+        """
+        Back to slice lists (A, B, C, D), each as wide as the largest leaf needs.
+        """
+        reached = set()
+        stack = [u]
+        while stack:
+            v = stack.pop()
+            if v not in reached:
+                reached.add(v)
+                if self.nodes[v][0] != self.LEAF:
+                    stack.extend(self.nodes[v][1:])
+        r = max(max(abs(c) for c in self.nodes[v][1]).bit_length()
+                for v in reached if self.nodes[v][0] == self.LEAF) + 1
+        return self._build(u, r, dict())
+
+    def _build(self, u, r, memo):
+        if u in memo:
+            return memo[u]
+        entry = self.nodes[u]
+        if entry[0] == self.LEAF:
+            out = [[self.BDD.true if (c >> i) & 1 else self.BDD.false for i in range(r)] for c in entry[1]]
+        else:
+            lev, lo, hi = entry
+            g = self.BDD.var(self.names[lev])
+            out = [[self.BDD.ite(g, fh, fl) for fl, fh in zip(xl, xh)]
+                   for xl, xh in zip(self._build(lo, r, memo), self._build(hi, r, memo))]
+        memo[u] = out
+        return out
+
+    def add(self, u, v):
+        if u == self.zero:
+            return v
+        if v == self.zero:
+            return u
+        key = (min(u, v), max(u, v))
+        if key in self.add_memo:
+            return self.add_memo[key]
+        lev = min(self.level(u), self.level(v))
+        if lev == self.LEAF:
+            res = self.leaf(tuple(x + y for x, y in zip(self.nodes[u][1], self.nodes[v][1])))
+        else:
+            u0, u1 = self.cofactors(u, lev)
+            v0, v1 = self.cofactors(v, lev)
+            res = self.node(lev, self.add(u0, v0), self.add(u1, v1))
+        self.add_memo[key] = res
+        return res
+
+    def scale(self, u, shift):
+        """
+        u * 2^shift.
+        """
+        if shift == 0 or u == self.zero:
+            return u
+        key = (u, shift)
+        if key in self.scale_memo:
+            return self.scale_memo[key]
+        entry = self.nodes[u]
+        if entry[0] == self.LEAF:
+            res = self.leaf(tuple(c << shift for c in entry[1]))
+        else:
+            res = self.node(entry[0], self.scale(entry[1], shift), self.scale(entry[2], shift))
+        self.scale_memo[key] = res
+        return res
+
+    @staticmethod
+    def _mul_leaf(x, y):
+        # Polynomials in w, lowest power first, with w^4 = -1
+        xs, ys = x[::-1], y[::-1]
+        prod = [0, 0, 0, 0]
+        for i, a in enumerate(xs):
+            if a:
+                for j, b in enumerate(ys):
+                    if i + j < 4:
+                        prod[i + j] += a * b
+                    else:
+                        prod[i + j - 4] -= a * b
+        return tuple(prod[::-1])
+
+    def matmul(self, x, y, summed):
+        """
+        sum over the variables at the levels in summed (both values each) of x * y, i.e. the matrix product
+        when x and y share exactly these variables, and the pointwise product when summed is empty.
+        Memoised on node pairs; a summed variable that neither side depends on doubles the result.
+        """
+        summed = sorted(summed)
+        memo = dict()
+
+        def skipped(above, below):
+            # Number of summed levels strictly between two levels
+            return bisect_left(summed, below) - bisect_right(summed, above)
+
+        def top(x, y):
+            return min(self.level(x), self.level(y))
+
+        def mm(x, y):
+            # Summed over the summed levels at or below top(x, y)
+            if x == self.zero or y == self.zero:
+                return self.zero
+            if (x, y) in memo:
+                return memo[(x, y)]
+            lev = top(x, y)
+            if lev == self.LEAF:
+                res = self.leaf(self._mul_leaf(self.nodes[x][1], self.nodes[y][1]))
+            else:
+                x0, x1 = self.cofactors(x, lev)
+                y0, y1 = self.cofactors(y, lev)
+                lo = self.scale(mm(x0, y0), skipped(lev, top(x0, y0)))
+                hi = self.scale(mm(x1, y1), skipped(lev, top(x1, y1)))
+                res = self.add(lo, hi) if lev in summed_set else self.node(lev, lo, hi)
+            memo[(x, y)] = res
+            return res
+
+        summed_set = set(summed)
+        return self.scale(mm(x, y), skipped(-1, top(x, y)))
 
 
 class BDDSeqSim:
-    def __init__(self, n, m, r):
+    def __init__(self, n, m, r, manager=None):
         """
             n represents the number of all qubits
             m represents the number of input qubits
+            comb_bdd, stored_bdd and input_bdd share one BDD manager and one variable set (q0 ... q(n-1)),
+            so moving a state between phases is a variable rename inside that manager.
+            manager: an existing BDD manager to use (e.g., a BDDSimulator kernel's); a new one is created if None
         """
-        self.comb_bdd = BDDCombSim(n, r)
-        self.stored_bdd = BDDCombSim(m, r)
-        self.input_bdd = BDDCombSim(n - m, r)
+        self.comb_bdd = BDDCombSim(n, r, manager=manager)
+        self.BDD = self.comb_bdd.BDD
+        self.stored_bdd = BDDCombSim(m, r, manager=self.BDD)
+        self.input_bdd = BDDCombSim(n - m, r, manager=self.BDD)
         self.n = n
         self.m = m
         self.r = r
         self.k = 0
         self.prob_list = []
+        # Outcome variable names of every measure_symbolic() call, one list per call
+        self.outcome_vars = []
+        # Stored qubit i is placed on q(i + n - m) in the combined circuit
+        self.to_comb = {'q%d' % i: 'q%d' % (i + n - m) for i in range(m)}
+        self.to_stored = {'q%d' % (i + n - m): 'q%d' % i for i in range(m)}
 
     def init_stored_state_by_basis(self, basis):
         assert basis < (1 << self.m), "Basis state is out of range!"
         tmp = dict()
         for i in range(self.m):
             tmp['q%d' % i] = bool((basis >> (self.m - 1 - i)) & 1)
-        self.stored_bdd.Fd[0] = self.stored_bdd.BDD.cube(tmp)
+        self.stored_bdd.Fd[0] = self.BDD.cube(tmp)
+        self.stored_bdd.norm = None
 
     def init_stored_state_by_bdd(self, bdd):
-        self.stored_bdd = bdd
+        self.stored_bdd = self._import_state(bdd, self.m)
+
+    def _import_state(self, bdd, n):
+        if bdd.BDD is self.BDD:
+            return bdd
+        # One-off import into the shared manager
+        state = BDDCombSim(n, bdd.r, manager=self.BDD)
+        state.Fa = [bdd.BDD.copy(f, self.BDD) for f in bdd.Fa]
+        state.Fb = [bdd.BDD.copy(f, self.BDD) for f in bdd.Fb]
+        state.Fc = [bdd.BDD.copy(f, self.BDD) for f in bdd.Fc]
+        state.Fd = [bdd.BDD.copy(f, self.BDD) for f in bdd.Fd]
+        state.k = bdd.k
+        state.norm = bdd.norm
+        return state
 
     def init_input_state_by_basis(self, basis):
         num = self.n - self.m
         assert basis < (1 << num), "Basis state is out of range!"
-        tmp = dict()
-        for i in range(num):
-            tmp['q%d' % i] = bool((basis >> (num - 1 - i)) & 1)
-        self.input_bdd.Fd[0] = self.input_bdd.BDD.cube(tmp)
+        # Also clears a general input state left by init_input_state_by_bdd
+        self.input_bdd.init_basis_state(basis)
 
-    # def init_input_state_by_bdd(self, bdd):
-    #     self.input_bdd = bdd
+    def init_input_state_by_bdd(self, bdd):
+        """
+        General input state over q0 ... q(n-m-1), e.g. a coin prepared in superposition once instead of by gates
+        in every iteration. init_comb_bdd tensors it with the stored state.
+        """
+        self.input_bdd = self._import_state(bdd, self.n - self.m)
+
+    def _input_is_flat(self):
+        # All nonzero input amplitudes equal 1 / sqrt(2)^k (a basis state, or e.g. |+>): only Fd[0] is set
+        false = self.BDD.false
+        x = self.input_bdd
+        return all(f == false for f in x.Fa + x.Fb + x.Fc + x.Fd[1:])
 
     def init_comb_bdd(self):
         """
@@ -831,24 +1793,31 @@ class BDDSeqSim:
             self.stored_bdd.signed_extend(self.input_bdd.r - self.stored_bdd.r)
         elif self.input_bdd.r < self.stored_bdd.r:
             self.input_bdd.signed_extend(self.stored_bdd.r - self.input_bdd.r)
-        self.comb_bdd = BDDCombSim(self.n, self.stored_bdd.r)
-
-        def tensor(x, y):
-            tmpx = self.input_bdd.BDD.copy(x, self.comb_bdd.BDD)
-            tmpy = self.stored_bdd.BDD.copy(y, self.comb_bdd.BDD)
-            tmpd = dict()
-            for i in range(self.m):
-                tmpd['q%d' % i] = 'q%d' % (i + self.n - self.m)
-            tmpy = self.comb_bdd.BDD.let(tmpd, tmpy)
-            return tmpx & tmpy
 
-        for i in range(self.comb_bdd.r):
-            # Because input_bdd is represented by a basis state, it only has Fd[0].
-            self.comb_bdd.Fa[i] = tensor(self.input_bdd.Fd[0], self.stored_bdd.Fa[i])
-            self.comb_bdd.Fb[i] = tensor(self.input_bdd.Fd[0], self.stored_bdd.Fb[i])
-            self.comb_bdd.Fc[i] = tensor(self.input_bdd.Fd[0], self.stored_bdd.Fc[i])
-            self.comb_bdd.Fd[i] = tensor(self.input_bdd.Fd[0], self.stored_bdd.Fd[i])
-        self.comb_bdd.k = self.stored_bdd.k
+        if self._input_is_flat():
+            # The input is an indicator times 1 / sqrt(2)^k, so the product is a conjunction per slice.
+            x = self.input_bdd.Fd[0]
+            tensor = lambda y: x & self.BDD.let(self.to_comb, y)
+            self.comb_bdd.Fa = [tensor(y) for y in self.stored_bdd.Fa]
+            self.comb_bdd.Fb = [tensor(y) for y in self.stored_bdd.Fb]
+            self.comb_bdd.Fc = [tensor(y) for y in self.stored_bdd.Fc]
+            self.comb_bdd.Fd = [tensor(y) for y in self.stored_bdd.Fd]
+            self.comb_bdd.r = self.stored_bdd.r
+        else:
+            # General input: multiply the coefficients of both states in Z[w] in one pass over the product
+            # diagram (disjoint variables, so nothing is summed), then slice the result once.
+            stored = [[self.BDD.let(self.to_comb, y) for y in x]
+                      for x in (self.stored_bdd.Fa, self.stored_bdd.Fb, self.stored_bdd.Fc, self.stored_bdd.Fd)]
+            vdd = _ValueDD(self.BDD)
+            inputs = (self.input_bdd.Fa, self.input_bdd.Fb, self.input_bdd.Fc, self.input_bdd.Fd)
+            u = vdd.matmul(vdd.from_slices(inputs), vdd.from_slices(stored), [])
+            comps = [self.comb_bdd._trim(x) for x in vdd.to_slices(u)]
+            r = max(len(x) for x in comps)
+            self.comb_bdd.Fa, self.comb_bdd.Fb, self.comb_bdd.Fc, self.comb_bdd.Fd = (
+                x + [x[-1]] * (r - len(x)) for x in comps)
+            self.comb_bdd.r = r
+        self.comb_bdd.k = self.stored_bdd.k + self.input_bdd.k
+        self.comb_bdd.norm = None
         self.r = self.comb_bdd.r
         self.k = self.comb_bdd.k
 
@@ -904,35 +1873,199 @@ class BDDSeqSim:
         self.comb_bdd.reset(target)
 
     def measure(self, result_list):
-        
         l = len(result_list)
         assert l == self.n - self.m, "The length of result list is wrong!"
         self.prob_list.append(self.comb_bdd.get_prob(list(range(l)), result_list))
+        self._post_select(result_list)
+
+    def _post_select(self, result_list):
+        """
+        Fixes the input qubits of comb_bdd to result_list and moves the remaining state to stored_bdd.
+        """
+        l = len(result_list)
         d = {'q%d' % j: bool(result_list[j]) for j in range(l)}
         for i in range(self.comb_bdd.r):
-            self.comb_bdd.Fa[i] = self.comb_bdd.BDD.let(d, self.comb_bdd.Fa[i])
-            self.comb_bdd.Fb[i] = self.comb_bdd.BDD.let(d, self.comb_bdd.Fb[i])
-            self.comb_bdd.Fc[i] = self.comb_bdd.BDD.let(d, self.comb_bdd.Fc[i])
-            self.comb_bdd.Fd[i] = self.comb_bdd.BDD.let(d, self.comb_bdd.Fd[i])
+            self.comb_bdd.Fa[i] = self.BDD.let(d, self.comb_bdd.Fa[i])
+            self.comb_bdd.Fb[i] = self.BDD.let(d, self.comb_bdd.Fb[i])
+            self.comb_bdd.Fc[i] = self.BDD.let(d, self.comb_bdd.Fc[i])
+            self.comb_bdd.Fd[i] = self.BDD.let(d, self.comb_bdd.Fd[i])
+        self.comb_bdd.norm = None
         self.comb_bdd.simplify_tail()
-        self.stored_bdd = BDDCombSim(self.m, self.comb_bdd.r)
+
+        # The input qubits are fixed now, so the stored state is a rename of comb_bdd.
+        update = lambda x: self.BDD.let(self.to_stored, x)
+        self.stored_bdd.Fa = [update(x) for x in self.comb_bdd.Fa]
+        self.stored_bdd.Fb = [update(x) for x in self.comb_bdd.Fb]
+        self.stored_bdd.Fc = [update(x) for x in self.comb_bdd.Fc]
+        self.stored_bdd.Fd = [update(x) for x in self.comb_bdd.Fd]
+        self.stored_bdd.r = self.comb_bdd.r
         self.stored_bdd.k = self.comb_bdd.k
+        self.stored_bdd.norm = None
 
-        def update(x):
-            tmpd = dict()
-            for i in range(self.m):
-                tmpd['q%d' % (i + self.n - self.m)] = 'q%d' % i
-            x = self.comb_bdd.BDD.let(tmpd, x)
-            return self.comb_bdd.BDD.copy(x, self.stored_bdd.BDD)
+        self.r = self.stored_bdd.r
+        self.k = self.stored_bdd.k
 
-        for i in range(self.comb_bdd.r):
-            self.stored_bdd.Fa[i] = update(self.comb_bdd.Fa[i])
-            self.stored_bdd.Fb[i] = update(self.comb_bdd.Fb[i])
-            self.stored_bdd.Fc[i] = update(self.comb_bdd.Fc[i])
-            self.stored_bdd.Fd[i] = update(self.comb_bdd.Fd[i])
+    def measure_symbolic(self):
+        """
+        [Symbolic outcome mode]
+        Measures the input qubits without fixing the outcome: input qubit j of the t-th such measurement is renamed
+        to a fresh variable o<t>_<j>, so the stored state becomes sum_o |o> (x) psi_o over every outcome sequence o
+        so far, with ||psi_o||^2 the probability of o. Nothing is appended to prob_list; query the outcomes with
+        sequence_prob, predicate_prob or sequence_distribution.
+        """
+        names = ['o%d_%d' % (len(self.outcome_vars), j) for j in range(self.n - self.m)]
+        for v in names:
+            self.BDD.add_var(v)
+        self.outcome_vars.append(names)
+        flat = [v for t in self.outcome_vars for v in t]
+        self.comb_bdd.outcome_vars = flat
+        self.stored_bdd.outcome_vars = flat
+
+        # One rename: input qubits to the outcome variables, the others to the stored qubits
+        rename = dict(self.to_stored)
+        rename.update({'q%d' % j: v for j, v in enumerate(names)})
+        update = lambda x: self.BDD.let(rename, x)
+        self.stored_bdd.Fa = [update(x) for x in self.comb_bdd.Fa]
+        self.stored_bdd.Fb = [update(x) for x in self.comb_bdd.Fb]
+        self.stored_bdd.Fc = [update(x) for x in self.comb_bdd.Fc]
+        self.stored_bdd.Fd = [update(x) for x in self.comb_bdd.Fd]
+        self.stored_bdd.r = self.comb_bdd.r
+        self.stored_bdd.k = self.comb_bdd.k
+        # A measurement without post-selection keeps the norm
+        self.stored_bdd.norm = self.comb_bdd.norm
+
+        self.r = self.stored_bdd.r
+        self.k = self.stored_bdd.k
+
+    def outcome_var(self, t, j=0):
+        """
+        BDD variable of the outcome of input qubit j at the t-th symbolic measurement, for building predicates.
+        """
+        return self.BDD.var(self.outcome_vars[t][j])
+
+    def predicate_prob(self, predicate):
+        """
+        Probability that the symbolic outcomes satisfy predicate (a BDD over the outcome variables), jointly with
+        every outcome fixed by measure() so far: one norm count of the stored state restricted to predicate.
+        """
+        return self.stored_bdd.predicate_prob(predicate)
 
+    def sequence_prob(self, sequence):
+        """
+        Probability of one outcome sequence, sequence[t] being the result list of the t-th symbolic measurement
+        (a prefix of the measured sequence is allowed: the later outcomes are summed over).
+        """
+        assignment = {v: bool(b) for names, results in zip(self.outcome_vars, sequence)
+                      for v, b in zip(names, results)}
+        return self.predicate_prob(self.BDD.cube(assignment))
+
+    def sequence_distribution(self):
+        """
+        {sequence: probability} for every symbolic outcome sequence of nonzero amplitude, sequence being a tuple
+        of result tuples. Costs one norm count per reachable sequence.
+        """
+        flat = [v for names in self.outcome_vars for v in names]
+        stored = ['q%d' % i for i in range(self.m)]
+        reachable = self.BDD.exist(stored, self.stored_bdd.nonzero_support())
+        dist = dict()
+        for assignment in self.BDD.pick_iter(reachable, care_vars=flat):
+            sequence = tuple(tuple(int(assignment[v]) for v in names) for names in self.outcome_vars)
+            dist[sequence] = self.predicate_prob(self.BDD.cube(assignment))
+        return dist
+
+    def body_operator(self, body, result_list, input_basis=0):
+        """
+        [Operator mode]
+        The post-selected map L of one loop iteration on the stored qubits, as a BDD relation:
+        body(self) applies the body's gates to comb_bdd, the input qubits start in |input_basis> and are measured
+        as result_list. Returns a BDDCombSim over q0 ... q(m-1) (the output) whose slices also depend on the
+        input copies p0 ... p(m-1), i.e. the coefficients of L[q, p] in the same w-slicing as a state.
+        The body is simulated once, on sum_p |p>|p>; stored_bdd and prob_list are left unchanged.
+        """
+        for i in range(self.m):
+            self.BDD.add_var('p%d' % i)
+        saved = self.stored_bdd.snapshot()
+        diagonal = self.BDD.true
+        for i in range(self.m):
+            diagonal &= ~self.BDD.apply('^', self.BDD.var('q%d' % i), self.BDD.var('p%d' % i))
+        zero = (self.BDD.false,) * self.stored_bdd.r
+        self.stored_bdd.restore((zero, zero, zero, (diagonal,) + zero[1:], self.stored_bdd.r, 0, None,
+                                 saved[7], saved[8]))
+
+        self.init_input_state_by_basis(input_basis)
+        self.init_comb_bdd()
+        body(self)
+        self._post_select(result_list)
+
+        op = self.stored_bdd.fork()
+        self.stored_bdd.restore(saved)
+        self.r = self.stored_bdd.r
+        self.k = self.stored_bdd.k
+        return op
+
+    def compose(self, left, right):
+        """
+        The product left * right of two body operators (right acts first). right may also be a stored state,
+        which gives the state left|right>. The shared index is renamed to t0 ... t(m-1) on both sides and
+        summed out on exact multi-terminal diagrams (_ValueDD), then sliced again.
+        """
+        for i in range(self.m):
+            self.BDD.add_var('t%d' % i)
+        inner = {'p%d' % i: 't%d' % i for i in range(self.m)}
+        outer = {'q%d' % i: 't%d' % i for i in range(self.m)}
+        xs = [[self.BDD.let(inner, f) for f in x] for x in (left.Fa, left.Fb, left.Fc, left.Fd)]
+        ys = [[self.BDD.let(outer, f) for f in y] for y in (right.Fa, right.Fb, right.Fc, right.Fd)]
+
+        vdd = _ValueDD(self.BDD)
+        u = vdd.matmul(vdd.from_slices(xs), vdd.from_slices(ys),
+                       [self.BDD.level_of_var(t) for t in outer.values()])
+        comps = [left._trim(x) for x in vdd.to_slices(u)]
+
+        r = max(len(x) for x in comps)
+        result = left.fork()
+        result.Fa, result.Fb, result.Fc, result.Fd = (x + [x[-1]] * (r - len(x)) for x in comps)
+        result.r = r
+        result.k = left.k + right.k
+        result.norm = None
+        # Divide out common factors of 2 (one slice each, k -= 2) as simplify_tail does after a measurement
+        while result.r > 1 and result.k >= 2 and all(x[0] == self.BDD.false for x in
+                                                     (result.Fa, result.Fb, result.Fc, result.Fd)):
+            result.simplify_tail()
+        return result
+
+    def operator_power(self, op, power):
+        """
+        op^power by repeated squaring, i.e. O(log power) operator products.
+        """
+        assert power >= 1, "The power must be positive!"
+        result = None
+        while True:
+            if power & 1:
+                result = op if result is None else self.compose(op, result)
+            power >>= 1
+            if not power:
+                return result
+            op = self.compose(op, op)
+
+    def apply_operator(self, op, power=1):
+        """
+        Applies op^power to the stored state, as power consecutive iterations of the body with the outcomes of op.
+        The state is multiplied by op^(2^j) for the set bits j of power, so it takes O(log power) operator products
+        instead of power body simulations. Appends the cumulative probability of the whole pattern to prob_list
+        once, so get_step_prob() afterwards is the probability of all power iterations together.
+        """
+        assert power >= 0, "The power must be non-negative!"
+        state = self.stored_bdd
+        while power:
+            if power & 1:
+                state = self.compose(op, state)
+            power >>= 1
+            if power:
+                op = self.compose(op, op)
+        self.stored_bdd.restore(state.snapshot())
         self.r = self.stored_bdd.r
         self.k = self.stored_bdd.k
+        self.prob_list.append(self.stored_bdd.get_norm())
 
     def get_step_prob(self):
         if len(self.prob_list) == 1:
@@ -941,6 +2074,7 @@ class BDDSeqSim:
             return self.prob_list[-1] / self.prob_list[-2]
 
     def print_stored_state_vec(self):
-        for i in range(1 << self.m):
+        # Only nonzero amplitudes, in basis order
+        for i, coeffs in sorted(self.stored_bdd.iter_nonzero()):
             print("The amplitude of |%s> is" % bin(i)[2:].zfill(self.m),
-                  self.stored_bdd.get_amplitude(i) / sqrt(self.prob_list[-1]), end='.\n')
+                  self.stored_bdd.coeffs_to_amplitude(coeffs) / sqrt(self.prob_list[-1]), end='.\n')
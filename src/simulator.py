@@ -1,11 +1,153 @@
 import random
 import math
+import copy
+from collections import OrderedDict, deque
+import numpy as np
 from typing import List, Dict, Optional, Any
-from src.kernel import BDDCombSim
+from src.kernel import BDDCombSim, BDDSeqSim
 from src.parser import CQC, DQC, SQC, GateOp
 
+class TrieNode:
+    """One mid-measurement outcome history: the branch probability of its last outcome and, if cached, a state"""
+    def __init__(self, parent: Optional['TrieNode'] = None, outcome: Optional[int] = None, prob: float = 1.0):
+        self.parent = parent
+        self.outcome = outcome
+        self.prob = prob  # Probability of `outcome`, normalized by the parent state
+        self.state: Optional[tuple] = None
+        self.children: Dict[int, 'TrieNode'] = {}
+
+    def prob_of_zero(self) -> Optional[float]:
+        # Known once either child has been simulated
+        if 0 in self.children:
+            return self.children[0].prob
+        if 1 in self.children:
+            return 1.0 - self.children[1].prob
+        return None
+
+class OutcomeTrieCache:
+    """
+    Simulator states keyed by the mid-measurement outcome history, organised as a trie (root = initial state).
+    Control flow is fixed by the outcome history, so a run can resume from the deepest cached state on its path.
+    At most max_entries states are kept (LRU eviction); evicted nodes keep their probabilities, so sampling
+    through them still needs no kernel call.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.root: Optional[TrieNode] = None
+        self._lru: 'OrderedDict[int, TrieNode]' = OrderedDict()
+
+    def clear(self):
+        self.root = None
+        self._lru.clear()
+
+    def set_root(self, state: tuple):
+        self.clear()
+        self.root = TrieNode()
+        self.root.state = state
+
+    def touch(self, node: TrieNode):
+        if id(node) in self._lru:
+            self._lru.move_to_end(id(node))
+
+    def record(self, parent: TrieNode, outcome: int, prob: float, state: tuple) -> TrieNode:
+        node = parent.children.get(outcome)
+        if node is None:
+            node = TrieNode(parent, outcome, prob)
+            parent.children[outcome] = node
+        self.store(node, state)
+        return node
+
+    def store(self, node: TrieNode, state: tuple):
+        node.state = state
+        self._lru[id(node)] = node
+        self._lru.move_to_end(id(node))
+        while len(self._lru) > self.max_entries:
+            _, old = self._lru.popitem(last=False)
+            old.state = None
+            # Drop stateless leaves, they carry nothing a later run could resume from
+            while old.parent is not None and old.state is None and not old.children:
+                if old.parent.children.get(old.outcome) is not old:
+                    break  # Already detached (the current run may still be below it)
+                del old.parent.children[old.outcome]
+                old = old.parent
+
+class LoopMarkovChain:
+    """
+    Transfer structure of one while-loop on its internal register (see BDDSimulator.loop_markov_chain).
+    cont_ops: continue Kraus maps (d x d); exit_ops: exit maps into the full register (2^n x d);
+    psi0: normalized internal entry state; runs_body: whether the loop condition holds on entry.
+    Density matrices are vectorised row-major, so vec(K rho K^dagger) = (K (x) conj(K)) vec(rho).
+    """
+    def __init__(self, cont_ops: List[np.ndarray], exit_ops: List[np.ndarray], psi0: np.ndarray, runs_body: bool):
+        d = len(psi0)
+        self.d = d
+        self.runs_body = runs_body
+        self.exit_ops = exit_ops
+        self.rho0 = np.outer(psi0, psi0.conj()).reshape(-1)
+        self.S = np.zeros((d * d, d * d), dtype=complex)
+        for K in cont_ops:
+            self.S += np.kron(K, K.conj())
+        # Exit probability of one iteration from rho is tr(M rho) = M^T . vec(rho)
+        M = np.zeros((d, d), dtype=complex)
+        for E in exit_ops:
+            M += E.conj().T @ E
+        self.exit_functional = M.T.reshape(-1)
+
+    def _resolvent(self, vec: np.ndarray) -> np.ndarray:
+        # sum_j S^j vec = (I - S)^-1 vec; least squares keeps a non-terminating part finite
+        A = np.eye(self.d * self.d) - self.S
+        return np.linalg.lstsq(A, vec, rcond=None)[0]
+
+    def iteration_distribution(self, k_max: int) -> np.ndarray:
+        """
+        P(N = k) for k = 0 .. k_max, N being the number of body executions.
+        """
+        probs = np.zeros(k_max + 1)
+        if not self.runs_body:
+            probs[0] = 1.0
+            return probs
+        rho = self.rho0
+        for k in range(1, k_max + 1):
+            probs[k] = (self.exit_functional @ rho).real
+            rho = self.S @ rho
+        return probs
+
+    def termination_probability(self) -> float:
+        if not self.runs_body:
+            return 1.0
+        return float((self.exit_functional @ self._resolvent(self.rho0)).real)
+
+    def expected_iterations(self) -> float:
+        """
+        E[N | the loop terminates] = sum_k k P(N = k) / P(terminate), with sum_k k S^(k-1) = (I - S)^-2.
+        """
+        if not self.runs_body:
+            return 0.0
+        p = self.termination_probability()
+        if p == 0.0:
+            return math.inf
+        return float((self.exit_functional @ self._resolvent(self._resolvent(self.rho0))).real) / p
+
+    def exit_state(self) -> np.ndarray:
+        """
+        Unnormalized density matrix (2^n x 2^n) of the full register on loop exit; its trace is the
+        termination probability.
+        """
+        if not self.runs_body:
+            raise ValueError("[Markov] The loop body is never entered.")
+        X = self._resolvent(self.rho0).reshape(self.d, self.d)
+        return sum(E @ X @ E.conj().T for E in self.exit_ops)
+
+class PrunedBranch(Exception):
+    """Raised inside an explore-mode branch once all of its continuations have been pruned"""
+
 class BDDSimulator:
-    def __init__(self, parsed_blocks: list, precision: int = 32):
+    def __init__(self, parsed_blocks: list, precision: int = 32, cache_size: int = 0):
+        """
+        cache_size: if positive, states after mid-circuit measurements are kept in an OutcomeTrieCache of this
+                    many entries, so later runs (preset sweeps, repeated sampling) resume from the deepest
+                    cached prefix of their outcome history instead of starting over.
+        """
         self.blocks = parsed_blocks
         if not self.blocks:
             self.num_qubits = 0
@@ -16,11 +158,49 @@ class BDDSimulator:
         self.kernel = BDDCombSim(self.num_qubits, precision) 
         if hasattr(self.kernel, 'init_basis_state'):
             self.kernel.init_basis_state(0)
+        # Every run starts from this kernel snapshot (assign another one to change the input state)
+        self.initial_state = self.kernel.snapshot()
         
         self.clbit_store: Dict[int, int] = {}
+        self.num_clbits = self._count_clbits(self.blocks)
         self.mode = 'sample'
         self.presets: Dict[int, List[int]] = {}
         
+        # Multi-shot readout: final measurements are deferred (clbit -> qubit) and sampled jointly after the run
+        self.shots: Optional[int] = None
+        self.deferred_final: Dict[int, int] = {}
+        self.counts: Optional[Dict[str, int]] = None
+        
+        # Explore mode: distribution over (bitstring, loop iterations), pruning bounds and pruned mass
+        self.epsilon = 1e-12
+        self.max_depth: Optional[int] = None
+        self.distribution: Optional[Dict[tuple, float]] = None
+        self.pruned_probability = 0.0
+        self.loop_iterations: List[int] = []
+        
+        # Loop fixpoints: SQC iterations that return to an earlier state (up to a scalar) are skipped in closed form
+        self.detect_loop_cycles = True
+        # Only the states of this many most recent loop boundaries are kept, i.e. cycles up to this length are found
+        self.loop_cycle_history = 16
+        self.loop_cycles: List[Dict[str, Any]] = []
+        self._mid_log: List[tuple] = []  # (clbit, outcome, branch probability) of every plain mid-measurement
+        self._forced: List[int] = []  # Sample-mode outcomes imposed by a cycle skip
+        # Loops with at most this many internal qubits get a LoopMarkovChain in self.loop_chains on entry (0 = off)
+        self.markov_max_internal = 0
+        self.loop_chains: List['LoopMarkovChain'] = []
+        self._body_break = False
+        # Qualifying loops run on BDDSeqSim (see _run_sqc_sequential), each recording its prob_list here
+        self.sequential_sqc = False
+        self.loop_prob_lists: List[List[float]] = []
+        
+        # Shot splitting (sample mode with shots): the branch being simulated, or None
+        self._branch: Optional[Dict[str, Any]] = None
+        self.num_branches = 0
+        
+        # Outcome-history state cache and the current run's position in it (None if unused)
+        self.cache = OutcomeTrieCache(cache_size) if cache_size > 0 else None
+        self._cursor: Optional[Dict[str, Any]] = None
+        
         # Global cumulative probability (for normalization)
         self.global_probability = 1.0
         
@@ -30,43 +210,611 @@ class BDDSimulator:
             'cx': 'CNOT', 'cz': 'CZ', 'swap': 'SWAP', 'ccx': 'Toffoli', 'cswap': 'Fredkin'
         }
 
-    def run(self, mode: str = 'sample', presets: Optional[Dict[int, List[int]]] = None):
+    def run(self, mode: str = 'sample', presets: Optional[Dict[int, List[int]]] = None,
+            shots: Optional[int] = None, epsilon: float = 1e-12, max_depth: Optional[int] = None):
+        """
+        mode='explore': every mid-circuit measurement forks both outcomes, so all paths through DQC branches
+               and SQC iterations are simulated once each (see _run_explore). Returns the exact distribution
+               {(bitstring, loop iterations): probability}, also kept in self.distribution. Paths whose
+               probability drops below `epsilon` or that take more than `max_depth` mid-measurements are
+               pruned; their total mass is self.pruned_probability.
+        mode='deferred': no measurement collapses; every DQC branch is taken under its classical condition in one
+               symbolic pass (see _run_deferred). Returns the exact distribution {bitstring: probability}, also
+               kept in self.distribution; loop paths are pruned below `epsilon` as in explore mode.
+        shots: if given, the program is simulated once up to the final-measurement frontier, then
+               `shots` joint samples of all final measurements are drawn from the resulting state.
+               Returns a counts histogram {bitstring: count} (clbit 0 is the rightmost bit) instead
+               of the classical store.
+               In sample mode, the shots are split binomially at every mid-circuit measurement and each
+               distinct outcome branch is simulated once, carrying its shot count (see _run_split_shots).
+        Every run starts from self.initial_state. With a state cache, it resumes from the deepest cached state
+        matching its outcome history (not used together with shot splitting).
+        """
         self.mode = mode
         self.presets = presets if presets else {}
+        self.kernel.restore(self.initial_state)
         self.clbit_store.clear()
         self.global_probability = 1.0 # Reset probability
+        self.shots = shots
+        self.deferred_final.clear()
+        self.counts = None
+        self._branch = None
+        self._cursor = None
+        self.num_branches = 0
+        self.loop_iterations = []
+        self.loop_cycles = []
+        self.loop_chains = []
+        self.loop_prob_lists = []
+        self._mid_log = []
+        self._forced = []
+        self.epsilon = epsilon
+        self.max_depth = max_depth
+        self.distribution = None
+        self.pruned_probability = 0.0
         
         print(f"\n[Sim] Starting Simulation (Mode: {self.mode}, Qubits: {self.num_qubits})...")
         try:
-            self._execute_blocks(self.blocks)
+            if self.mode == 'explore':
+                self.distribution = self._run_explore()
+            elif self.mode == 'deferred':
+                self.distribution = self._run_deferred()
+            elif self.shots is not None and self.mode == 'sample':
+                self.counts = self._run_split_shots(self.shots)
+            else:
+                self._start_cursor()
+                self._execute_blocks(self.blocks)
+                self._materialize()
+                self._cursor = None
+                if self.shots is not None:
+                    self.counts = self._sample_final_measurements(self.shots)
             print("[Sim] Simulation Finished Successfully.")
         except Exception as e:
             print(f"[Sim] Simulation Failed: {e}")
             raise e
+        if self.mode in ('explore', 'deferred'):
+            return self.distribution
+        if self.shots is not None:
+            return self.counts
         return self.clbit_store
 
-    def print_state_vec(self):
+    def snapshot(self) -> tuple:
+        """
+        Captures (kernel snapshot, classical store, global probability); O(r), all BDD nodes are shared.
+        """
+        return self.kernel.snapshot(), dict(self.clbit_store), self.global_probability
+
+    def restore(self, state: tuple):
+        kernel_state, clbit_store, self.global_probability = state
+        self.kernel.restore(kernel_state)
+        self.clbit_store = dict(clbit_store)
+
+    def fork(self) -> 'BDDSimulator':
+        """
+        Independent simulator continuing from the current state, with the kernel forked in the same
+        manager (O(r)). It shares the program and the state cache.
+        """
+        twin = copy.copy(self)
+        twin.kernel = self.kernel.fork()
+        twin.clbit_store = dict(self.clbit_store)
+        twin.presets = {c: list(v) for c, v in self.presets.items()}
+        twin.deferred_final = dict(self.deferred_final)
+        twin.counts = dict(self.counts) if self.counts is not None else None
+        twin._branch = None
+        twin._cursor = None
+        return twin
+
+    def set_input_family(self, qubits: List[int], basis: int = 0):
+        """
+        Every run starts from all basis states that agree with `basis` outside `qubits` at once, one symbolic
+        simulation for the 2^len(qubits) inputs (BDDCombSim.init_basis_family). Mid-measurement probabilities
+        are those of a uniformly random input; per-input results come from input_state / input_probability.
+        """
+        self.kernel.init_basis_family(qubits, basis)
+        self.initial_state = self.kernel.snapshot()
+
+    def input_state(self, value: int) -> BDDCombSim:
+        """
+        The final state of the last run for one input of the family (unnormalized, as the kernel keeps it).
+        """
+        return self.kernel.for_input(value)
+
+    def input_probability(self, value: int) -> float:
+        """
+        Probability that the last run's measurement path (e.g. its presets) is taken for one input of the family.
+        """
+        return self.kernel.for_input(value).get_norm()
+
+    def _cache_state(self) -> tuple:
+        # Cached per trie node: the clbits are rebuilt by the replay itself
+        return self.kernel.snapshot(), self.global_probability
+
+    def _restore_cache_state(self, state: tuple):
+        kernel_state, self.global_probability = state
+        self.kernel.restore(kernel_state)
+
+    def _start_cursor(self):
+        """
+        Places the run at the trie root. The run then replays lazily: gates are buffered (not applied) and
+        mid-measurements descend the trie while their outcomes are cached; the kernel is only brought up to
+        date (_materialize) when a state is actually needed.
+        """
+        self._cursor = None
+        if self.cache is None:
+            return
+        if self.cache.root is None or self.cache.root.state[0] is not self.initial_state:
+            # Cached histories are only valid for the initial state they started from
+            self.cache.set_root((self.initial_state, 1.0))
+        root = self.cache.root
+        self._cursor = {'node': root, 'anchor': root, 'buffer': [], 'live': False}
+
+    def _materialize(self):
+        """
+        Restores the deepest cached state passed so far and re-applies what was buffered after it.
+        """
+        cur = self._cursor
+        if cur is None or cur['live']:
+            return
+        self._restore_cache_state(cur['anchor'].state)
+        for item in cur['buffer']:
+            if isinstance(item, GateOp):
+                self._apply_gate(item)
+                continue
+            q_idx, val, node = item
+            _, branch_prob = self.kernel.measure_collapse(q_idx, val)
+            self.global_probability *= branch_prob
+            if node.state is None:
+                self.cache.store(node, self._cache_state())
+        cur['buffer'] = []
+        cur['live'] = True
+
+    def _cached_measurement(self, q_idx: int, preset_val: Optional[int]) -> int:
+        """
+        Mid-measurement with the state cache: reuses a cached child of the current history if possible,
+        otherwise measures on the (materialized) kernel and caches the result.
+        """
+        cur = self._cursor
+        node = cur['node']
+        val = preset_val
+        if val is None:
+            prob_0 = node.prob_of_zero()
+            if prob_0 is not None:
+                val = 0 if random.random() < prob_0 else 1
+        child = node.children.get(val) if val is not None else None
+        if child is not None and (child.state is not None or not cur['live']):
+            if child.state is not None:
+                self.cache.touch(child)
+                cur.update(anchor=child, buffer=[], live=False)
+            else:
+                cur['buffer'].append((q_idx, val, child))
+            cur['node'] = child
+            return val
+        
+        self._materialize()
+        measured_val, branch_prob = self.kernel.measure_collapse(q_idx, val)
+        self.global_probability *= branch_prob
+        cur['node'] = cur['anchor'] = self.cache.record(node, measured_val, branch_prob, self._cache_state())
+        return measured_val
+
+    def _run_branches(self, shots: Optional[int], on_leaf):
+        """
+        Runs the program once per mid-measurement outcome branch.
+        A branch is (outcome history, forked kernel, path probability, shots). A queued branch replays the
+        control flow along its outcome history without touching the kernel, then continues from the forked
+        state; new branches are queued by _split_measurement. on_leaf() is called after every completed branch.
+        Afterwards kernel, clbit_store and global_probability hold the last simulated branch.
+        """
+        entry_store = dict(self.clbit_store)
+        pending = [([], self.kernel.fork(), 1.0, shots)]
+        while pending:
+            outcomes, kernel, prob, branch_shots = pending.pop()
+            self.kernel = kernel
+            self.global_probability = prob
+            self.clbit_store = dict(entry_store)
+            self.deferred_final.clear()
+            self.loop_iterations = []
+            self._branch = {'outcomes': list(outcomes), 'replay': len(outcomes), 'pos': 0,
+                            'shots': branch_shots, 'pending': pending}
+            self._body_break = False
+            try:
+                self._execute_blocks(self.blocks)
+            except PrunedBranch:
+                continue
+            except StopIteration:
+                # Only when a loop body is run on its own (loop_markov_chain)
+                self._body_break = True
+            on_leaf()
+            self.num_branches += 1
+        self._branch = None
+
+    def loop_markov_chain(self, sqc: SQC) -> 'LoopMarkovChain':
+        """
+        [Loop transfer structure] Builds the Markov chain of `sqc` entered from the current state and classical
+        store, for loops with a small internal register (all qubits but the flag-measured ones).
+        At a loop boundary the flag qubits have just been measured, so the state is |m> (x) |psi> with a fixed
+        flag pattern m. The body is simulated once per internal basis input |m>|b>, following every
+        mid-measurement outcome path o; a path is a linear map K_o (its dense output column for b).
+        Paths ending with the loop condition still true (and no break) form the continue superoperator
+        sum_o K_o (x) conj(K_o); the others are exit maps. Queries are then solved by linear algebra.
+        """
+        if any(isinstance(blk, SQC) for blk in self._walk_blocks(sqc.body_block)):
+            raise ValueError("[Markov] Nested while-loops are not supported.")
+        ext = sorted(sqc.external_qubits)
+        internal = sorted(sqc.internal_qubits)
+        n = self.num_qubits
+        d = 1 << len(internal)
+        axes = ext + internal
+
+        def split(vec):
+            # Dense state -> (flag pattern, internal) matrix
+            return np.transpose(vec.reshape((2,) * n), axes).reshape(1 << len(ext), d)
+
+        def flag_row(mat):
+            rows = np.flatnonzero(np.abs(mat).sum(axis=1) > 1e-12)
+            if len(rows) != 1:
+                raise ValueError("[Markov] Flag qubits are not in a definite state at the loop boundary.")
+            return rows[0]
+
+        entry = split(self.kernel.to_numpy())
+        m = flag_row(entry)
+        psi0 = entry[m] / np.linalg.norm(entry[m])
+        entry_store = dict(self.clbit_store)
+        runs_body = self._read_clbit_register(sqc.loop_condition['indices']) == sqc.loop_condition['value']
+
+        cont: Dict[tuple, np.ndarray] = {}
+        exits: Dict[tuple, np.ndarray] = {}
+        body = self.fork()
+        body.blocks = sqc.body_block
+        body.mode = 'explore'
+        body.epsilon = 0.0
+        body.max_depth = None
+        for b in range(d):
+            basis = 0
+            for q, bit in zip(ext, format(m, '0%db' % len(ext)) if ext else ''):
+                basis |= int(bit) << (n - 1 - q)
+            for q, bit in zip(internal, format(b, '0%db' % len(internal)) if internal else ''):
+                basis |= int(bit) << (n - 1 - q)
+            body.kernel = self.kernel.fork()
+            body.kernel.init_basis_state(basis)
+            body.clbit_store = dict(entry_store)
+            leaves = []
+            body._run_branches(None, lambda: leaves.append((tuple(body._branch['outcomes']), body._body_break,
+                                                            dict(body.clbit_store), body.kernel.to_numpy())))
+            for outcomes, broke, store, vec in leaves:
+                flag = sum(store.get(idx, 0) << i for i, idx in enumerate(sqc.loop_condition['indices']))
+                if not broke and flag == sqc.loop_condition['value']:
+                    out = split(vec)
+                    if flag_row(out) != m:
+                        raise ValueError("[Markov] A continuing path changes the flag qubits' pattern.")
+                    cont.setdefault(outcomes, np.zeros((d, d), dtype=complex))[:, b] = out[m]
+                else:
+                    exits.setdefault(outcomes, np.zeros((1 << n, d), dtype=complex))[:, b] = vec
+        return LoopMarkovChain(list(cont.values()), list(exits.values()), psi0, runs_body)
+
+    @staticmethod
+    def _walk_blocks(blocks: list):
+        for blk in blocks:
+            yield blk
+            if isinstance(blk, DQC):
+                for sub_blks in blk.cases.values():
+                    yield from BDDSimulator._walk_blocks(sub_blks)
+                yield from BDDSimulator._walk_blocks(blk.default_block)
+            elif isinstance(blk, SQC):
+                yield from BDDSimulator._walk_blocks(blk.body_block)
+
+    def _run_split_shots(self, shots: int) -> Dict[str, int]:
+        """
+        [Shot splitting] At a mid-circuit measurement the branch's shot count is split binomially between
+        the two outcomes and the 1-branch is queued, so each distinct branch is simulated once.
+        Final measurements of each branch are sampled for its own shot count.
+        """
+        counts: Dict[str, int] = {}
+
+        def on_leaf():
+            for key, cnt in self._sample_final_measurements(self._branch['shots']).items():
+                counts[key] = counts.get(key, 0) + cnt
+
+        self._run_branches(shots, on_leaf)
+        return counts
+
+    def _run_explore(self) -> Dict[tuple, float]:
+        """
+        [Exhaustive exploration] Both outcomes of every mid-circuit measurement are followed; the exact
+        joint distribution of the final measurements is read off each path's final state.
+        Keys are (bitstring, loop_iterations), loop_iterations holding the iteration count of every executed
+        SQC in order of completion.
+        """
+        distribution: Dict[tuple, float] = {}
+
+        def on_leaf():
+            c_list = sorted(self.deferred_final)
+            q_list = [self.deferred_final[c] for c in c_list]
+            for bits, prob in self._final_distribution(q_list):
+                store = dict(self.clbit_store)
+                store.update(zip(c_list, bits))
+                key = (self._clbits_to_str(store), tuple(self.loop_iterations))
+                distribution[key] = distribution.get(key, 0.0) + prob
+
+        self._run_branches(None, on_leaf)
+        return distribution
+
+    def _run_deferred(self) -> Dict[str, float]:
+        """
+        [Deferred measurement] Every measurement records its outcome in a fresh kernel variable m<t> instead of
+        collapsing (BDDCombSim.measure_deferred), so each clbit holds a BDD over the outcome variables. A DQC case
+        body is applied to the state restricted to its condition on those clbits and merged back
+        (BDDCombSim.merge_under); an SQC body likewise, once per iteration while its condition has nonzero
+        probability. The distribution of all clbits is read off the single final state.
+        """
+        self._cbits: Dict[int, Any] = {}
+        self._deferred_blocks(self.blocks)
+        bdd = self.kernel.BDD
+        funcs = [self._cbits.get(c, bdd.false) for c in range(self.num_clbits)]
+        distribution: Dict[str, float] = {}
+        stack = [((), bdd.true, self.kernel.get_norm())]
+        while stack:
+            bits, cond, prob = stack.pop()
+            if len(bits) == len(funcs):
+                distribution[self._clbits_to_str(dict(enumerate(bits)))] = prob
+                continue
+            f = funcs[len(bits)]
+            for b, lit in ((0, ~f), (1, f)):
+                branch = cond & lit
+                if branch == bdd.false:
+                    continue
+                # A bit that does not split the path keeps its probability
+                p = prob if branch == cond else self.kernel.predicate_prob(branch)
+                if p > 0.0:
+                    stack.append((bits + (b,), branch, p))
+        return distribution
+
+    def _deferred_blocks(self, blocks: list):
+        bdd = self.kernel.BDD
+        for blk in blocks:
+            if isinstance(blk, CQC):
+                for op in blk.ops:
+                    if op.name == 'break':
+                        raise ValueError("[Deferred] 'break' is not supported in deferred mode.")
+                    if op.name != 'measure':
+                        self._apply_gate(op)
+                        continue
+                    for q_idx, c_idx in zip(op.qubits, op.c_targets):
+                        name = 'm%d' % len(self.kernel.outcome_vars)
+                        self.kernel.measure_deferred(q_idx, name)
+                        self._cbits[c_idx] = bdd.var(name)
+            elif isinstance(blk, DQC):
+                # All conditions are taken before any case body changes the clbits
+                taken = bdd.false
+                branches = []
+                for val, body in blk.cases.items():
+                    cond = self._register_equals(blk.target_clbits, val)
+                    branches.append((cond & ~taken, body))
+                    taken |= cond
+                branches.append((~taken, blk.default_block))
+                for cond, body in branches:
+                    self._deferred_branch(cond, body)
+            elif isinstance(blk, SQC):
+                indices, value = blk.loop_condition['indices'], blk.loop_condition['value']
+                iteration = 0
+                MAX_ITER = 1000
+                while True:
+                    cond = self._register_equals(indices, value)
+                    if cond == bdd.false:
+                        break
+                    prob = self.kernel.predicate_prob(cond)
+                    if prob == 0.0:
+                        break
+                    if prob < self.epsilon:
+                        # The paths still looping are dropped
+                        self.pruned_probability += prob
+                        self.kernel.restrict(~cond)
+                        break
+                    if iteration >= MAX_ITER:
+                        raise RuntimeError(f"Max iterations (= {MAX_ITER}) reached in SQC.")
+                    self._deferred_branch(cond, blk.body_block)
+                    iteration += 1
+
+    def _deferred_branch(self, cond, blocks: list):
+        """
+        Runs `blocks` where cond holds and leaves the state unchanged elsewhere; outcome variables introduced by
+        the branch are 0 outside it, where the clbits keep their previous values.
+        """
+        bdd = self.kernel.BDD
+        if cond == bdd.false or not blocks:
+            return
+        before = self.kernel.snapshot()
+        cbits_before = dict(self._cbits)
+        num_vars = len(self.kernel.outcome_vars)
+        if cond != bdd.true:
+            self.kernel.restrict(cond)
+            if self.kernel.nonzero_support() == bdd.false:
+                # A branch with zero probability
+                self.kernel.restore(before)
+                return
+        self._deferred_blocks(blocks)
+        if cond == bdd.true:
+            return
+        new_vars = self.kernel.outcome_vars[num_vars:]
+        fixed = bdd.cube({v: False for v in new_vars}) if new_vars else None
+        self.kernel.merge_under(cond, before, fixed)
+        for c_idx in set(self._cbits) | set(cbits_before):
+            old = cbits_before.get(c_idx, bdd.false)
+            self._cbits[c_idx] = bdd.ite(cond, self._cbits.get(c_idx, bdd.false), old)
+
+    def _register_equals(self, indices: List[int], value: int):
+        # BDD over the outcome variables: the symbolic clbits `indices` read as `value` (index 0 lowest)
+        bdd = self.kernel.BDD
+        if value >> len(indices):
+            return bdd.false
+        cond = bdd.true
+        for i, idx in enumerate(indices):
+            f = self._cbits.get(idx, bdd.false)
+            cond &= f if (value >> i) & 1 else ~f
+        return cond
+
+    def _final_distribution(self, q_list: List[int]) -> List[tuple]:
+        """
+        Exact joint outcomes of measuring q_list on the current path (no collapse), as (bits, path probability).
+        Outcomes are expanded prefix by prefix, so zero-probability prefixes are never extended.
+        """
+        norm = self.kernel.get_norm()
+        out = []
+        stack = [((), self.global_probability)]
+        while stack:
+            bits, prob = stack.pop()
+            if len(bits) == len(q_list):
+                out.append((bits, prob))
+                continue
+            for b in (0, 1):
+                prefix = bits + (b,)
+                p = self.global_probability * self.kernel.get_prob(q_list[:len(prefix)], list(prefix)) / norm
+                if p == 0.0:
+                    continue
+                if p < self.epsilon:
+                    self.pruned_probability += p
+                    continue
+                stack.append((prefix, p))
+        return out
+
+    def _split_measurement(self, q_idx: int) -> int:
+        """
+        Mid-measurement of the current branch: replays the recorded outcome, or forks the other outcome
+        (split shots, or explore mode).
+        """
+        br = self._branch
+        if br['pos'] < br['replay']:
+            br['pos'] += 1
+            return br['outcomes'][br['pos'] - 1]
+        
+        if self.mode == 'explore':
+            measured_val, branch_prob = self._explore_outcomes(q_idx)
+        else:
+            fork = self.kernel.fork()
+            _, prob_0 = self.kernel.measure_collapse(q_idx, 0)
+            shots_0 = _binomial(br['shots'], prob_0)
+            if shots_0 == 0:
+                self.kernel = fork
+                measured_val, branch_prob = self.kernel.measure_collapse(q_idx, 1)
+            else:
+                measured_val, branch_prob = 0, prob_0
+                if shots_0 < br['shots']:
+                    _, prob_1 = fork.measure_collapse(q_idx, 1)
+                    br['pending'].append((br['outcomes'] + [1], fork, self.global_probability * prob_1,
+                                          br['shots'] - shots_0))
+                    br['shots'] = shots_0
+        
+        self.global_probability *= branch_prob
+        br['outcomes'].append(measured_val)
+        br['pos'] += 1
+        br['replay'] = br['pos']
+        return measured_val
+
+    def _explore_outcomes(self, q_idx: int) -> tuple:
+        """
+        Collapses to both outcomes, continues with the first kept one and queues the other.
+        Outcomes below epsilon or beyond max_depth are pruned (raises PrunedBranch if none is kept).
+        """
+        br = self._branch
+        fork = self.kernel.fork()
+        _, prob_0 = self.kernel.measure_collapse(q_idx, 0)
+        outcomes = []
+        if prob_0 > 0.0:
+            outcomes.append((0, self.kernel, prob_0))
+        if prob_0 < 1.0:
+            _, prob_1 = fork.measure_collapse(q_idx, 1)
+            outcomes.append((1, fork, prob_1))
+        
+        kept = []
+        too_deep = self.max_depth is not None and br['pos'] >= self.max_depth
+        for val, kernel, prob in outcomes:
+            path_prob = self.global_probability * prob
+            if too_deep or path_prob < self.epsilon:
+                self.pruned_probability += path_prob
+            else:
+                kept.append((val, kernel, prob))
+        if not kept:
+            raise PrunedBranch()
+        
+        for val, kernel, prob in kept[1:]:
+            br['pending'].append((br['outcomes'] + [val], kernel, self.global_probability * prob, None))
+        measured_val, self.kernel, branch_prob = kept[0]
+        return measured_val, branch_prob
+
+    def _sample_final_measurements(self, shots: int) -> Dict[str, int]:
+        """
+        Draw `shots` joint samples of the deferred final measurements (no re-simulation) and
+        combine each with the classical store into a counts histogram.
+        """
+        c_list = sorted(self.deferred_final)
+        q_list = [self.deferred_final[c] for c in c_list]
+        if not c_list:
+            samples = [()] * shots
+        elif hasattr(self.kernel, 'sample_measurements'):
+            samples = self.kernel.sample_measurements(q_list, shots)
+        else:
+            raise AttributeError("Kernel missing 'sample_measurements' method.")
+        
+        counts: Dict[str, int] = {}
+        for bits in samples:
+            store = dict(self.clbit_store)
+            store.update(zip(c_list, bits))
+            key = self._clbits_to_str(store)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _clbits_to_str(self, store: Dict[int, int]) -> str:
+        # Qiskit convention: clbit 0 is the rightmost character
+        return ''.join(str(store.get(i, 0)) for i in reversed(range(self.num_clbits)))
+
+    @staticmethod
+    def _count_clbits(blocks: list) -> int:
+        highest = -1
+        
+        def scan(blks: list):
+            nonlocal highest
+            for blk in blks:
+                if isinstance(blk, CQC):
+                    for op in blk.ops:
+                        highest = max([highest] + op.c_targets)
+                elif isinstance(blk, DQC):
+                    highest = max([highest] + blk.target_clbits)
+                    for sub_blks in blk.cases.values():
+                        scan(sub_blks)
+                    scan(blk.default_block)
+                elif isinstance(blk, SQC):
+                    highest = max([highest] + blk.loop_condition.get('indices', []))
+                    scan(blk.body_block)
+        
+        scan(blocks)
+        return highest + 1
+
+    def print_state_vec(self, max_terms: int = 1 << 20):
         """
         Print the normalized quantum state vector.
         Automatically handles probability collapse caused by intermediate measurements.
+        Only nonzero amplitudes are enumerated, so the cost scales with the support, not 2^n.
+        Amplitudes are normalized by the kernel's own norm, which differs from global_probability once loop
+        cycles were skipped in closed form (_jump_cycles scales the probability, not the state, which is then
+        only determined up to a global phase).
         """
         print(f"\n--- Final Quantum State Vector (Normalized) ---")
         print(f"Global Probability Factor: {self.global_probability:.6f}")
         
-        if self.global_probability <= 0:
+        state_norm = self.kernel.get_norm()
+        if self.global_probability <= 0 or state_norm <= 0:
             print("State has collapsed to 0 probability (Impossible path).")
             return
 
-        norm_factor = math.sqrt(self.global_probability)
+        norm_factor = math.sqrt(state_norm)
         
-        # For large number of qubits, do not attempt to iterate over all states!
-        if self.num_qubits > 20:
-            print(f"Num qubits ({self.num_qubits}) is too large to print full state vector.")
+        # Do not attempt to print a huge support!
+        num_terms = self.kernel.count_nonzero()
+        if num_terms > max_terms:
+            print(f"Num nonzero amplitudes ({num_terms}) is too large to print full state vector.")
             return
 
-        for i in range(1 << self.num_qubits):
+        for i, coeffs in sorted(self.kernel.iter_nonzero()):
             # Get raw amplitude
-            raw_amp = self.kernel.get_amplitude(i)
+            raw_amp = self.kernel.coeffs_to_amplitude(coeffs)
             # Normalize
             norm_amp = raw_amp / norm_factor
             
@@ -74,6 +822,21 @@ class BDDSimulator:
             if abs(norm_amp) > 1e-10:
                 print(f"|{bin(i)[2:].zfill(self.num_qubits)}>: {norm_amp:.6f}")
 
+    def state_vector(self, exact: bool = False):
+        """
+        Return the normalized quantum state vector as a dense NumPy array (index i = basis state i).
+        Intended for small and medium qubit counts (up to about 28).
+        exact: return the kernel's exact, unnormalized (4, 2^n) integer coefficient array instead
+               (amplitude = (a * w^3 + b * w^2 + c * w + d) / sqrt(2)^k with k = self.kernel.k).
+        """
+        if exact:
+            return self.kernel.to_numpy(exact=True)
+        state_norm = self.kernel.get_norm()
+        if self.global_probability <= 0 or state_norm <= 0:
+            raise ValueError("State has collapsed to 0 probability (Impossible path).")
+        # The kernel's own norm, as in print_state_vec
+        return self.kernel.to_numpy() / math.sqrt(state_norm)
+
     def _execute_blocks(self, blocks: list):
         for block in blocks:
             if isinstance(block, CQC):
@@ -99,6 +862,18 @@ class BDDSimulator:
         expected_val = sqc.loop_condition['value']
         iteration = 0
         MAX_ITER = 1000
+        # Recent loop-boundary states for cycle detection: ((support, clbits), iteration, snapshot, mid-log position)
+        seen = deque(maxlen=self.loop_cycle_history)
+        # None of the shortcuts is defined per input of a family, so all are skipped for one
+        family = bool(self.kernel.input_vars)
+        if (0 < len(sqc.internal_qubits) <= self.markov_max_internal and self._branch is None
+                and self._cursor is None and not family):
+            self.loop_chains.append(self.loop_markov_chain(sqc))
+        if (self.sequential_sqc and self.mode in ('sample', 'preset') and self._branch is None
+                and self._cursor is None and not family):
+            ops = self._sequential_ops(sqc)
+            if ops is not None and self._run_sqc_sequential(sqc, ops):
+                return
         
         while True:
             current_val = self._read_clbit_register(target_indices)
@@ -107,30 +882,221 @@ class BDDSimulator:
             if iteration >= MAX_ITER:
                 raise RuntimeError(f"Max iterations (= {MAX_ITER}) reached in SQC.")
             
+            if self.detect_loop_cycles and self._branch is None and self._cursor is None and not family:
+                key = (int(self.kernel.nonzero_support()), tuple(sorted(self.clbit_store.items())))
+                for seen_key, start, state, log_pos in seen:
+                    if seen_key == key and self.kernel.proportional_to(state):
+                        iteration = self._jump_cycles(start, iteration, log_pos, MAX_ITER)
+                        seen.clear()
+                        break
+                else:
+                    seen.append((key, iteration, self.kernel.snapshot(), len(self._mid_log)))
+                if iteration >= MAX_ITER:
+                    raise RuntimeError(f"Max iterations (= {MAX_ITER}) reached in SQC.")
+            
             try:
                 self._execute_blocks(sqc.body_block)
             except StopIteration:
+                iteration += 1
                 break
             iteration += 1
+        self.loop_iterations.append(iteration)
+
+    def _sequential_ops(self, sqc: SQC) -> Optional[List[GateOp]]:
+        """
+        The body of `sqc` as one op list if it fits BDDSeqSim: plain gates plus exactly one mid-measurement of
+        every flag (external) qubit, which the parser has checked to be that qubit's last operation. None otherwise.
+        """
+        ops = []
+        for blk in sqc.body_block:
+            if not isinstance(blk, CQC):
+                return None
+            ops.extend(blk.ops)
+        measured = []
+        for op in ops:
+            if op.name == 'measure':
+                if op.is_final_measure or not set(op.qubits) <= sqc.external_qubits:
+                    return None
+                measured.extend(op.qubits)
+            elif op.name not in self.GATE_METHOD_MAP:
+                return None
+        if sorted(measured) != sorted(sqc.external_qubits) or not sqc.internal_qubits:
+            return None
+        return ops
+
+    def _run_sqc_sequential(self, sqc: SQC, ops: List[GateOp]) -> bool:
+        """
+        [Sequential engine] Runs `sqc` on a BDDSeqSim in the kernel's manager, as exp/simulation/qrw.py does by
+        hand: the flag (external) qubits are its input register, prepared in the basis state of their last
+        outcomes at every iteration, and the internal qubits its stored register, so the flag qubits leave the
+        state after each iteration. The flag measurements are taken at the end of the body (no later gate
+        touches those qubits). The loop's prob_list (absolute path probability after every iteration) is
+        appended to self.loop_prob_lists.
+        Returns False, with nothing changed, unless the flag qubits are in a definite basis state at entry.
+        """
+        target_indices = sqc.loop_condition['indices']
+        expected_val = sqc.loop_condition['value']
+        if self._read_clbit_register(target_indices) != expected_val:
+            return False
+        ext = sorted(sqc.external_qubits)
+        internal = sorted(sqc.internal_qubits)
+        flags = []
+        for q in ext:
+            p0 = self.kernel.get_prob([q], [0])
+            p1 = self.kernel.get_prob([q], [1])
+            if p0 > 0.0 and p1 > 0.0:
+                return False
+            flags.append(1 if p1 > 0.0 else 0)
+
+        bdd = self.kernel.BDD
+        seq = BDDSeqSim(self.num_qubits, len(internal), self.kernel.r, manager=bdd)
+        # Combined-circuit index: flag qubit j -> j, internal qubit i -> len(ext) + i
+        comb = {q: j for j, q in enumerate(ext)}
+        comb.update({q: len(ext) + i for i, q in enumerate(internal)})
+        fix = {'q%d' % q: bool(v) for q, v in zip(ext, flags)}
+        to_stored = {'q%d' % q: 'q%d' % i for i, q in enumerate(internal)}
+        stored = BDDCombSim(len(internal), self.kernel.r, manager=bdd)
+        stored.Fa = [bdd.let(to_stored, bdd.let(fix, f)) for f in self.kernel.Fa]
+        stored.Fb = [bdd.let(to_stored, bdd.let(fix, f)) for f in self.kernel.Fb]
+        stored.Fc = [bdd.let(to_stored, bdd.let(fix, f)) for f in self.kernel.Fc]
+        stored.Fd = [bdd.let(to_stored, bdd.let(fix, f)) for f in self.kernel.Fd]
+        stored.k = self.kernel.k
+        stored.norm = None
+        seq.init_stored_state_by_bdd(stored)
+        entry_norm = self.kernel.get_norm()
+
+        iteration = 0
+        MAX_ITER = 1000
+        while self._read_clbit_register(target_indices) == expected_val:
+            if iteration >= MAX_ITER:
+                raise RuntimeError(f"Max iterations (= {MAX_ITER}) reached in SQC.")
+            seq.init_input_state_by_basis(int(''.join(map(str, flags)), 2))
+            seq.init_comb_bdd()
+            pending = []
+            for op in ops:
+                if op.name == 'measure':
+                    pending.extend(zip(op.qubits, op.c_targets))
+                else:
+                    getattr(seq.comb_bdd, self.GATE_METHOD_MAP[op.name])(*[comb[q] for q in op.qubits])
+
+            prob = seq.prob_list[-1] if seq.prob_list else entry_norm
+            targets, results = [], []
+            for q_idx, c_idx in pending:
+                if self.mode == 'preset':
+                    if not self.presets.get(c_idx):
+                        raise ValueError(f"No preset value available for clbit {c_idx}.")
+                    measured_val = self.presets[c_idx].pop(0)
+                else:
+                    p0 = seq.comb_bdd.get_prob(targets + [comb[q_idx]], results + [0])
+                    measured_val = 0 if random.random() < p0 / prob else 1
+                p = seq.comb_bdd.get_prob(targets + [comb[q_idx]], results + [measured_val])
+                if p == 0.0:
+                    raise ValueError("State collapsed to 0 probability.")
+                self._mid_log.append((c_idx, measured_val, p / prob))
+                self.clbit_store[c_idx] = measured_val
+                self.deferred_final.pop(c_idx, None)
+                targets.append(comb[q_idx])
+                results.append(measured_val)
+                prob = p
+            flags = [results[targets.index(j)] for j in range(len(ext))]
+            seq.measure(flags)
+            iteration += 1
+
+        # Back to the kernel: flag qubits in the basis state of their last outcomes, internal qubits from stored_bdd
+        cube = bdd.cube({'q%d' % q: bool(v) for q, v in zip(ext, flags)})
+        back = {v: k for k, v in to_stored.items()}
+        self.kernel.Fa = [cube & bdd.let(back, f) for f in seq.stored_bdd.Fa]
+        self.kernel.Fb = [cube & bdd.let(back, f) for f in seq.stored_bdd.Fb]
+        self.kernel.Fc = [cube & bdd.let(back, f) for f in seq.stored_bdd.Fc]
+        self.kernel.Fd = [cube & bdd.let(back, f) for f in seq.stored_bdd.Fd]
+        self.kernel.r = seq.stored_bdd.r
+        self.kernel.k = seq.stored_bdd.k
+        self.kernel.norm = None
+        self.global_probability *= seq.prob_list[-1] / entry_norm
+        self.loop_prob_lists.append(list(seq.prob_list))
+        self.loop_iterations.append(iteration)
+        return True
+
+    def _jump_cycles(self, start: int, iteration: int, log_pos: int, max_iter: int) -> int:
+        """
+        [Loop fixpoint] The state at this loop boundary equals (up to a scalar) the one at iteration `start`,
+        with the same classical store, so the cycle of `length` iterations in between repeats with the same
+        outcomes and branch probabilities. Its path probability rho is the product of the cycle's branch
+        probabilities, and m further repetitions are skipped in closed form (global_probability *= rho^m):
+        - preset: m is the number of times the cycle's outcomes repeat at the front of the presets;
+        - sample: m ~ Geometric(rho), then the next cycle is forced to leave the recorded path at step s,
+          drawn with probability p_1 ... p_(s-1) (1 - p_s) / (1 - rho).
+        Returns the new iteration count; every skip is recorded in self.loop_cycles.
+        """
+        length = iteration - start
+        cycle = self._mid_log[log_pos:]
+        if not cycle:
+            # Same state without any measurement in between: the loop cannot terminate
+            return max_iter
+        rho = 1.0
+        for _, _, prob in cycle:
+            rho *= prob
+        max_skip = (max_iter - iteration) // length + 1
+        
+        if self.mode == 'preset':
+            need: Dict[int, List[int]] = {}
+            for c_idx, val, _ in cycle:
+                need.setdefault(c_idx, []).append(val)
+            skip = max_skip
+            for c_idx, vals in need.items():
+                queue = self.presets.get(c_idx, [])
+                reps = 0
+                while reps < skip and queue[reps * len(vals):(reps + 1) * len(vals)] == vals:
+                    reps += 1
+                skip = reps
+            for c_idx, vals in need.items():
+                del self.presets[c_idx][:skip * len(vals)]
+        elif rho >= 1.0:
+            skip = max_skip
+        else:
+            skip = 0 if rho <= 0.0 else int(math.log(1.0 - random.random()) / math.log(rho))
+            skip = min(skip, max_skip)
+            if skip < max_skip:
+                # Leave the recorded path at step s of the next cycle
+                weights = []
+                prefix = 1.0
+                for _, _, prob in cycle:
+                    weights.append(prefix * (1.0 - prob))
+                    prefix *= prob
+                s = random.choices(range(len(cycle)), weights=weights)[0]
+                self._forced = [val for _, val, _ in cycle[:s]] + [1 - cycle[s][1]]
+        
+        self.global_probability *= rho ** skip
+        self.loop_cycles.append({'start': start, 'length': length, 'return_prob': rho, 'skipped': skip})
+        return iteration + skip * length
 
     def _dispatch_op(self, op: GateOp):
         if op.name == 'break':
             raise StopIteration("break")
         elif op.name == 'measure':
             self._handle_measurement(op)
+        elif self._branch is not None and self._branch['pos'] < self._branch['replay']:
+            # Replaying a forked branch: its state already includes this gate
+            return
+        elif self._cursor is not None and not self._cursor['live']:
+            # Replaying from the state cache: applied only if the state is needed later
+            self._cursor['buffer'].append(op)
         else:
-            method_name = self.GATE_METHOD_MAP.get(op.name)
-            if not method_name:
-                raise ValueError(f"Unknown gate '{op.name}'")
-            method = getattr(self.kernel, method_name, None)
-            if method:
-                method(*op.qubits)
+            self._apply_gate(op)
+
+    def _apply_gate(self, op: GateOp):
+        method_name = self.GATE_METHOD_MAP.get(op.name)
+        if not method_name:
+            raise ValueError(f"Unknown gate '{op.name}'")
+        method = getattr(self.kernel, method_name, None)
+        if method:
+            method(*op.qubits)
+        else:
+            apply_gate = getattr(self.kernel, 'apply_gate', None)
+            if apply_gate:
+                apply_gate(method_name, op.qubits)
             else:
-                apply_gate = getattr(self.kernel, 'apply_gate', None)
-                if apply_gate:
-                    apply_gate(method_name, op.qubits)
-                else:
-                    raise AttributeError(f"Kernel object has no method '{method_name}'")
+                raise AttributeError(f"Kernel object has no method '{method_name}'")
 
     def _handle_measurement(self, op: GateOp):
         """
@@ -144,60 +1110,51 @@ class BDDSimulator:
         for q_idx, c_idx in zip(op.qubits, op.c_targets):
             # 1) Final measurement: Only decide classical result, do not collapse quantum state
             if getattr(op, "is_final_measure", False):
+                has_preset = self.mode == 'preset' and bool(self.presets.get(c_idx))
+                if (self.shots is not None or self.mode == 'explore') and not has_preset:
+                    # Multi-shot / explore: sampled (enumerated) jointly with the other final measurements after the run
+                    self.deferred_final[c_idx] = q_idx
+                    continue
+                if not has_preset:
+                    self._materialize()
                 measured_val = self._decide_final_measure_value(q_idx, c_idx)
                 self.clbit_store[c_idx] = measured_val
+                self.deferred_final.pop(c_idx, None)
                 continue
 
-            # 2) Mid-measure: Execute original flow
-            prob_0_joint = 0.0
-            prob_1_joint = 0.0
-            
-            if hasattr(self.kernel, 'get_prob'):
-                try:
-                    prob_0_joint = self.kernel.get_prob([q_idx], [0])
-                    prob_1_joint = self.kernel.get_prob([q_idx], [1])
-                except RecursionError:
-                    print(f"[Sim Warning] Recursion limit reached during measurement of q[{q_idx}]. "
-                          f"Approximating/Skipping probability calculation (Assuming uniform if applicable).")
-                    prob_0_joint = 0.5 
-                    prob_1_joint = 0.5
-            else:
-                raise AttributeError("Kernel missing 'get_prob' method.")
-            
-            current_norm = prob_0_joint + prob_1_joint
-            
-            # [Key Modification]
-            # Original: if current_norm <= 1e-15:
-            # Modified: if current_norm == 0.0:
-            # Reason: For 256+ qubits, valid probability can be as low as 1e-78.
-            # Since Kernel now implements [Exact Zero Check], only returning 0.0 is truly impossible state.
-            if current_norm == 0.0:
-                raise ValueError("State collapsed to 0 probability.")
-            
-            real_prob_0 = prob_0_joint / current_norm
+            # 2) Mid-measure: probabilities and collapse from one kernel call
+            if self._branch is not None:
+                self.clbit_store[c_idx] = self._split_measurement(q_idx)
+                self.deferred_final.pop(c_idx, None)
+                continue
+            if not hasattr(self.kernel, 'measure_collapse'):
+                raise AttributeError("Kernel missing 'measure_collapse' method.")
             
-            # Decide result
+            # Decide result (None lets the kernel sample from the exact distribution)
             if self.mode == 'sample':
-                measured_val = 0 if random.random() < real_prob_0 else 1
+                preset_val = self._forced.pop(0) if self._forced else None
             elif self.mode == 'preset':
                 if c_idx in self.presets and len(self.presets[c_idx]) > 0:
-                    measured_val = self.presets[c_idx].pop(0)
+                    preset_val = self.presets[c_idx].pop(0)
                 else:
                     raise ValueError(f"No preset value available for clbit {c_idx}.")
             else:
-                measured_val = 0
+                preset_val = 0
+            
+            if self._cursor is not None:
+                self.clbit_store[c_idx] = self._cached_measurement(q_idx, preset_val)
+                self.deferred_final.pop(c_idx, None)
+                continue
+            
+            # Raises ValueError if the state has 0 probability ([Exact Zero Check] in the kernel)
+            measured_val, branch_prob = self.kernel.measure_collapse(q_idx, preset_val)
             
             # Accumulate global probability (only needed for mid-measure)
-            branch_prob = real_prob_0 if measured_val == 0 else (1.0 - real_prob_0)
             self.global_probability *= branch_prob
-            
-            # Collapse state
-            if hasattr(self.kernel, 'mid_measure'):
-                self.kernel.mid_measure([q_idx], [measured_val])
-            else:
-                raise AttributeError("Kernel missing 'mid_measure' method.")
+            self._mid_log.append((c_idx, measured_val, branch_prob))
             
             self.clbit_store[c_idx] = measured_val
+            self.deferred_final.pop(c_idx, None)
 
     def _decide_final_measure_value(self, q_idx: int, c_idx: int) -> int:
         """
@@ -216,8 +1173,8 @@ class BDDSimulator:
         if hasattr(self.kernel, 'get_prob'):
             try:
                 p0 = self.kernel.get_prob([q_idx], [0])
-                p1 = self.kernel.get_prob([q_idx], [1])
-                norm = p0 + p1
+                # The kernel tracks the exact norm, so p1 = norm - p0 needs no second query
+                norm = self.kernel.get_norm()
                 
                 # [Key Modification]
                 # Original: if norm > 1e-15:
@@ -240,3 +1197,14 @@ class BDDSimulator:
             bit_val = self.clbit_store.get(idx, 0)
             val += bit_val * (1 << i)
         return val
+
+
+def _binomial(n: int, p: float) -> int:
+    # Number of successes in n Bernoulli(p) trials, drawn from the `random` module (so seeding applies)
+    if p <= 0.0:
+        return 0
+    if p >= 1.0:
+        return n
+    if hasattr(random, 'binomialvariate'):
+        return random.binomialvariate(n, p)
+    return sum(1 for _ in range(n) if random.random() < p)
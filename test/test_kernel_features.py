@@ -0,0 +1,439 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import random
+import numpy as np
+from src.kernel import BDDCombSim, BDDSupportSim
+
+GATES_1 = ['X', 'Y', 'Z', 'H', 'S', 'T', 'SDG', 'TDG', 'X2P', 'Y2P']
+GATES_2 = ['CNOT', 'CZ', 'SWAP']
+
+
+def random_circuit(n, depth, seed, measure=False):
+    """A reproducible gate list [(name, args)], optionally with mid-circuit measurements ('M', (q, outcome))."""
+    rnd = random.Random(seed)
+    ops = []
+    for _ in range(depth):
+        kind = rnd.random()
+        if measure and kind < 0.08:
+            ops.append(('M', (rnd.randrange(n), rnd.randrange(2))))
+        elif kind < 0.25 and n >= 3:
+            ops.append((rnd.choice(['Toffoli', 'Fredkin']), tuple(rnd.sample(range(n), 3))))
+        elif kind < 0.45:
+            ops.append((rnd.choice(GATES_2), tuple(rnd.sample(range(n), 2))))
+        else:
+            ops.append((rnd.choice(GATES_1), (rnd.randrange(n),)))
+    return ops
+
+
+def apply_circuit(sim, ops):
+    """Applies ops to sim and returns the ops actually applied."""
+    applied = []
+    for name, args in ops:
+        if name == 'M':
+            q, outcome = args
+            # Keep only outcomes with nonzero probability, so both runs take the same path
+            if sim.get_prob([q], [outcome]) <= 1e-12:
+                continue
+            sim.mid_measure([q], [outcome])
+        else:
+            getattr(sim, name)(*args)
+        applied.append((name, args))
+    return applied
+
+
+def dense_reference(n, basis, ops):
+    """State vector by plain matrix multiplication (qubit 0 is the most significant bit)."""
+    w = np.exp(1j * np.pi / 4)
+    s2 = 1 / np.sqrt(2)
+    one = {
+        'X': [[0, 1], [1, 0]], 'Y': [[0, -1j], [1j, 0]], 'Z': [[1, 0], [0, -1]],
+        'H': [[s2, s2], [s2, -s2]], 'S': [[1, 0], [0, 1j]], 'T': [[1, 0], [0, w]],
+        'SDG': [[1, 0], [0, -1j]], 'TDG': [[1, 0], [0, np.conj(w)]],
+        'X2P': [[s2, -1j * s2], [-1j * s2, s2]], 'Y2P': [[s2, -s2], [s2, s2]],
+    }
+    psi = np.zeros(1 << n, dtype=complex)
+    psi[basis] = 1
+    bit = lambda i, q: (i >> (n - 1 - q)) & 1
+    for name, args in ops:
+        new = np.zeros_like(psi)
+        for i in range(1 << n):
+            if psi[i] == 0:
+                continue
+            if name in one:
+                q = args[0]
+                m = np.array(one[name])
+                b = bit(i, q)
+                for v in (0, 1):
+                    new[i ^ ((b ^ v) << (n - 1 - q))] += m[v][b] * psi[i]
+            elif name == 'M':
+                q, outcome = args
+                if bit(i, q) == outcome:
+                    new[i] += psi[i]
+            else:
+                j = i
+                if name == 'CNOT' and bit(i, args[0]):
+                    j ^= 1 << (n - 1 - args[1])
+                elif name == 'CZ' and bit(i, args[0]) and bit(i, args[1]):
+                    new[i] -= psi[i]
+                    continue
+                elif name == 'SWAP' and bit(i, args[0]) != bit(i, args[1]):
+                    j ^= (1 << (n - 1 - args[0])) | (1 << (n - 1 - args[1]))
+                elif name == 'Toffoli' and bit(i, args[0]) and bit(i, args[1]):
+                    j ^= 1 << (n - 1 - args[2])
+                elif name == 'Fredkin' and bit(i, args[0]) and bit(i, args[1]) != bit(i, args[2]):
+                    j ^= (1 << (n - 1 - args[1])) | (1 << (n - 1 - args[2]))
+                new[j] += psi[i]
+        psi = new
+    return psi
+
+
+def zw_mul(x, y):
+    # Product in Z[w] of (a, b, c, d) = a w^3 + b w^2 + c w + d, with w^4 = -1
+    xs, ys = x[::-1], y[::-1]
+    out = [0] * 4
+    for i in range(4):
+        for j in range(4):
+            if i + j < 4:
+                out[i + j] += xs[i] * ys[j]
+            else:
+                out[i + j - 4] -= xs[i] * ys[j]
+    return tuple(out[::-1])
+
+
+def coeffs_of(sim, comps, basis):
+    twin = sim.fork()
+    r = max(len(x) for x in comps)
+    twin.Fa, twin.Fb, twin.Fc, twin.Fd = (list(x) + [x[-1]] * (r - len(x)) for x in comps)
+    twin.r = r
+    return tuple(twin._coeffs_at(basis))
+
+
+def random_slices(sim, width, rnd):
+    """`width` random Boolean functions of the qubits, built from their truth tables."""
+    n = sim.n
+    slices = []
+    for _ in range(width):
+        f = sim.BDD.false
+        for basis in range(1 << n):
+            if rnd.random() < 0.5:
+                f |= sim.BDD.cube({'q%d' % q: bool((basis >> (n - 1 - q)) & 1) for q in range(n)})
+        slices.append(f)
+    return slices
+
+
+def test_ripple_add_matches_integer_sum():
+    # Full adder and half-adder paths, basis state by basis state, in two's complement
+    rnd = random.Random(1)
+    for width in (1, 2, 5):
+        sim = BDDCombSim(3, width)
+        false = [sim.BDD.false] * width
+        value = lambda x, basis: coeffs_of(sim, [false, false, false, x], basis)[3]
+        for _ in range(4):
+            A, B = random_slices(sim, width, rnd), random_slices(sim, width, rnd)
+            cin = random_slices(sim, 1, rnd)[0]
+            full, half = sim._ripple_add(A, B, cin), sim._ripple_add(A, None, cin)
+            assert len(full) == len(half) == width + 1
+            for basis in range(8):
+                carry = coeffs_of(sim, [false, false, false, [cin, sim.BDD.false]], basis)[3]
+                assert value(full, basis) == value(A, basis) + value(B, basis) + carry
+                assert value(half, basis) == value(A, basis) + carry
+
+
+def test_scale_coeffs_matches_integer_product():
+    # Carry-save products of the coefficient functions, checked basis state by basis state in Z[w]
+    rnd = random.Random(5)
+    for seed in range(12):
+        n = 3 + seed % 3
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(seed % (1 << n))
+        apply_circuit(sim, random_circuit(n, 30, seed))
+        alpha = tuple(rnd.choice([0, 1, -1, 3, -6, rnd.randrange(-10 ** 5, 10 ** 5)]) for _ in range(4))
+        product = sim._scale_coeffs([sim.Fa, sim.Fb, sim.Fc, sim.Fd], alpha)
+        for basis in range(1 << n):
+            assert coeffs_of(sim, product, basis) == zw_mul(tuple(sim._coeffs_at(basis)), alpha)
+
+
+def test_family_state_views_raise():
+    sim = BDDCombSim(3, 2)
+    sim.init_basis_family([0, 2])
+    sim.H(1)
+    for view in (lambda: sim.get_amplitude(0), sim.to_numpy, sim.export_node_table,
+                 lambda: sim.get_amplitudes([0, 1]), lambda: list(sim.iter_nonzero())):
+        try:
+            view()
+        except ValueError as e:
+            assert "for_input" in str(e)
+        else:
+            raise AssertionError("a basis-state view of a family did not raise")
+    # One member is an ordinary state: input 0b11 sets q0 = q2 = 1
+    member = sim.for_input(3)
+    expected = np.zeros(8)
+    expected[0b101] = expected[0b111] = 1 / np.sqrt(2)
+    assert np.allclose(member.to_numpy(), expected)
+
+
+def test_snapshot_keeps_variable_lists():
+    sim = BDDCombSim(2, 2)
+    sim.init_basis_state(0)
+    plain = sim.snapshot()
+    sim.init_basis_family([1])
+    family = sim.snapshot()
+    sim.H(0)
+    sim.measure_deferred(0, 'm_snap')
+    assert sim.outcome_vars == ['m_snap'] and sim.input_vars == ['x1']
+    sim.restore(family)
+    assert sim.outcome_vars == [] and sim.input_vars == ['x1']
+    sim.restore(plain)
+    assert sim.outcome_vars == [] and sim.input_vars == []
+    assert np.allclose(sim.to_numpy(), [1, 0, 0, 0])
+
+
+def test_gates_match_dense_reference():
+    for seed in range(20):
+        n = 3 + seed % 3
+        basis = seed % (1 << n)
+        ops = random_circuit(n, 40, seed)
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(basis)
+        apply_circuit(sim, ops)
+        assert np.allclose(sim.to_numpy(), dense_reference(n, basis, ops))
+
+
+def test_zero_components_stay_zero():
+    # Real-amplitude circuits only ever use Fd; Y/S/T/X2P then act on the zero components without adding
+    sim = BDDCombSim(3, 2)
+    sim.init_basis_state(0)
+    ops = [('H', (0,)), ('CNOT', (0, 1)), ('Y2P', (2,)), ('CZ', (1, 2)), ('Z', (0,)), ('X', (1,))]
+    apply_circuit(sim, ops)
+    false = sim.BDD.false
+    assert all(f == false for f in sim.Fa + sim.Fb + sim.Fc)
+    # S multiplies by i = w^2, which lives in Fb: Fa and Fc stay zero
+    ops.append(('S', (2,)))
+    sim.S(2)
+    assert all(f == false for f in sim.Fa + sim.Fc)
+    for name in ('Y', 'T', 'X2P'):
+        ops.append((name, (1,)))
+        getattr(sim, name)(1)
+    assert np.allclose(sim.to_numpy(), dense_reference(3, 0, ops))
+
+def dense_prob(n, psi, targets, results):
+    keep = [i for i in range(1 << n) if all((i >> (n - 1 - q)) & 1 == b for q, b in zip(targets, results))]
+    return float(np.sum(np.abs(psi[keep]) ** 2))
+
+
+def test_get_prob_matches_dense_reference():
+    # Unnormalized states (mid-circuit measurements), every outcome of random qubit subsets
+    rnd = random.Random(3)
+    for seed in range(12):
+        n = 3 + seed % 3
+        ops = random_circuit(n, 40, seed, measure=True)
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(0)
+        psi = dense_reference(n, 0, apply_circuit(sim, ops))
+        for _ in range(4):
+            targets = rnd.sample(range(n), rnd.randint(1, n))
+            results = [rnd.randrange(2) for _ in targets]
+            assert np.isclose(sim.get_prob(targets, results), dense_prob(n, psi, targets, results))
+
+
+def test_measure_collapse_matches_mid_measure():
+    # Both outcomes: the branch probability is normalized by the current norm, the state is the mid_measure one
+    for seed in range(10):
+        n = 3 + seed % 3
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(seed % (1 << n))
+        psi = dense_reference(n, seed % (1 << n), apply_circuit(sim, random_circuit(n, 40, seed, measure=True)))
+        norm = float(np.sum(np.abs(psi) ** 2))
+        for target in range(n):
+            for result in (0, 1):
+                expected = dense_prob(n, psi, [target], [result]) / norm
+                if expected < 1e-12:
+                    continue
+                fused, plain = sim.fork(), sim.fork()
+                outcome, prob = fused.measure_collapse(target, result)
+                assert outcome == result and np.isclose(prob, expected)
+                plain.mid_measure([target], [result])
+                assert np.allclose(fused.to_numpy(), plain.to_numpy())
+                assert np.isclose(fused.get_norm(), expected * norm)
+    # A sampled outcome never has probability 0
+    sim = BDDCombSim(2, 2)
+    sim.init_basis_state(0b01)
+    assert sim.measure_collapse(0) == (0, 1.0) and sim.measure_collapse(1) == (1, 1.0)
+
+
+def test_tracked_norm_matches_recount():
+    # Counted once, then carried through the gates (including the k changes of H/X2P/Y2P) and simplify_tail
+    for seed in range(10):
+        n = 3 + seed % 3
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(0)
+        applied = apply_circuit(sim, random_circuit(n, 20, seed, measure=True))
+        sim.get_norm()
+        gates = random_circuit(n, 30, seed + 100)
+        applied += apply_circuit(sim, gates)
+        assert sim.norm is not None
+        fresh = sim.fork()
+        fresh.norm = None
+        psi = dense_reference(n, 0, applied)
+        assert np.isclose(sim.get_norm(), fresh.get_norm())
+        assert np.isclose(sim.get_norm(), np.sum(np.abs(psi) ** 2))
+
+
+def shuffled_order_state(seed, n):
+    """A random state whose qubit variables are reordered away from q0 < q1 < ..."""
+    from dd import cudd
+    sim = BDDCombSim(n, 2)
+    sim.init_basis_state(seed % (1 << n))
+    applied = apply_circuit(sim, random_circuit(n, 40, seed, measure=True))
+    names = ['q%d' % q for q in range(n)]
+    random.Random(seed).shuffle(names)
+    cudd.reorder(sim.BDD, {v: i for i, v in enumerate(names)})
+    return sim, applied
+
+
+def test_iter_nonzero_matches_get_amplitude():
+    for seed in range(10):
+        n = 3 + seed % 4
+        sim, _ = shuffled_order_state(seed, n)
+        expected = {i: tuple(sim._coeffs_at(i)) for i in range(1 << n)}
+        expected = {i: c for i, c in expected.items() if any(c)}
+        found = dict(sim.iter_nonzero())
+        assert found == expected
+        assert sim.count_nonzero() == len(expected)
+
+
+def test_get_amplitudes_matches_get_amplitude():
+    rnd = random.Random(7)
+    for seed in range(10):
+        n = 3 + seed % 4
+        sim, _ = shuffled_order_state(seed, n)
+        basis = [rnd.randrange(1 << n) for _ in range(20)]
+        coeffs, amps = sim.get_amplitudes(basis)
+        assert coeffs.shape == (4, len(basis))
+        for col, i in enumerate(basis):
+            assert tuple(coeffs[:, col]) == tuple(sim._coeffs_at(i))
+            assert np.isclose(amps[col], sim.get_amplitude(i))
+        # The same queries as a 0/1 bit matrix, q0 in column 0
+        bits = [[(i >> (n - 1 - q)) & 1 for q in range(n)] for i in basis]
+        assert np.array_equal(sim.get_amplitudes(bits)[0], coeffs)
+
+
+def test_to_numpy_matches_dense_reference():
+    for seed in range(10):
+        n = 3 + seed % 4
+        sim, applied = shuffled_order_state(seed, n)
+        assert np.allclose(sim.to_numpy(), dense_reference(n, seed % (1 << n), applied))
+        exact = sim.to_numpy(exact=True)
+        assert exact.shape == (4, 1 << n)
+        for i in range(1 << n):
+            assert tuple(exact[:, i]) == tuple(sim._coeffs_at(i))
+
+
+def within_sampling_error(count, shots, p):
+    # Five standard deviations of the binomial count
+    return abs(count - shots * p) <= 5 * np.sqrt(shots * p * (1 - p)) + 1e-9
+
+
+def test_sample_measurements_match_get_prob():
+    random.seed(9)
+    shots = 4000
+    for seed in range(6):
+        n = 4
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(0)
+        apply_circuit(sim, random_circuit(n, 30, seed, measure=True))
+        qubits = random.Random(seed).sample(range(n), 3)
+        samples = sim.sample_measurements(qubits, shots)
+        assert len(samples) == shots
+        norm = sim.get_norm()
+        for outcome in range(8):
+            results = [(outcome >> (2 - j)) & 1 for j in range(3)]
+            p = sim.get_prob(qubits, results) / norm
+            assert within_sampling_error(samples.count(tuple(results)), shots, p)
+
+
+def test_sample_measurements_with_free_variables_above_qubits():
+    # Input and outcome variables moved to the top of the order: sampled qubits must still be read at their own level
+    from dd import cudd
+    random.seed(10)
+    shots = 2000
+    family = BDDCombSim(3, 2)
+    family.init_basis_family([0, 2], basis=0b010)
+    family.H(2)
+    family.T(2)
+    family.H(2)
+    deferred = BDDCombSim(3, 2)
+    deferred.init_basis_state(0)
+    deferred.H(0)
+    deferred.CNOT(0, 1)
+    deferred.measure_deferred(0, 'm_top')
+    deferred.H(2)
+    deferred.T(2)
+    deferred.H(2)
+    for sim, top in ((family, 'x0'), (deferred, 'm_top')):
+        names = [top] + [v for v in sim.BDD.vars if v != top]
+        cudd.reorder(sim.BDD, {v: i for i, v in enumerate(names)})
+        assert sim.BDD.level_of_var(top) == 0
+        samples = sim.sample_measurements([0, 1, 2], shots)
+        norm = sim.get_norm()
+        for q in range(3):
+            p = sim.get_prob([q], [1]) / norm
+            assert within_sampling_error(sum(s[q] for s in samples), shots, p)
+    # q1 is fixed to 1 in every member of the family
+    assert set(family.sample_measurements([1], 100)) == {(1,)}
+
+
+def test_support_sim_over_approximates_get_prob():
+    # A possible outcome is never missed; on exact steps the support is the true one
+    rnd = random.Random(13)
+    exact_runs = 0
+    for seed in range(16):
+        n = 3 + seed % 3
+        sim = BDDCombSim(n, 2)
+        sim.init_basis_state(seed % (1 << n))
+        support = BDDSupportSim(n, manager=sim.BDD)
+        support.init_basis_state(seed % (1 << n))
+        ops = random_circuit(n, 25, seed, measure=True)
+        if seed % 2:
+            # Permutation and diagonal gates only: every step is exact
+            ops = [op for op in ops if op[0] not in ('H', 'X2P', 'Y2P')]
+        for name, args in apply_circuit(sim, ops):
+            if name == 'M':
+                support.mid_measure([args[0]], [args[1]])
+            else:
+                getattr(support, name)(*args)
+        if support.exact:
+            exact_runs += 1
+            assert support.support == sim.nonzero_support()
+        for _ in range(6):
+            targets = rnd.sample(range(n), rnd.randint(1, n))
+            results = [rnd.randrange(2) for _ in targets]
+            reachable = sim.get_prob(targets, results) > 0
+            assert support.possible(targets, results) or not reachable
+            if support.exact:
+                assert support.possible(targets, results) == reachable
+    assert exact_runs >= 8
+
+
+def test_coefficient_width_stays_minimal():
+    # After every step: as few slices as the largest coefficient needs (two unless the tail was trimmed to one),
+    # and no factor of 2 left that could be divided out of all coefficients together with k
+    for seed in range(10):
+        n = 3 + seed % 3
+        sim = BDDCombSim(n, 32)
+        sim.init_basis_state(0)
+        for op in random_circuit(n, 40, seed, measure=True):
+            apply_circuit(sim, [op])
+            coeffs = sim.to_numpy(exact=True)
+            top = int(max(np.max(coeffs), -np.min(coeffs) - 1))
+            need = top.bit_length() + 1
+            assert sim.r == len(sim.Fd) and need <= sim.r <= max(2, need)
+            if sim.k >= 2 and np.any(coeffs):
+                assert np.any(coeffs % 2)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"{name}: OK")
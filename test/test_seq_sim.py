@@ -0,0 +1,140 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import itertools
+import numpy as np
+from src.kernel import BDDCombSim, BDDSeqSim
+
+
+def body(sim):
+    # One iteration on 1 input qubit (q0) and 2 stored qubits (q1, q2)
+    sim.H(0)
+    sim.T(0)
+    sim.CNOT(0, 1)
+    sim.H(2)
+    sim.Toffoli(0, 2, 1)
+    sim.H(0)
+
+
+def reference_run(results, stored_basis=0):
+    """The same loop on one BDDCombSim over all 3 qubits: the input qubit is reset to |0> and measured."""
+    ref = BDDCombSim(3, 2)
+    ref.init_basis_state(stored_basis)
+    probs = []
+    for result in results:
+        body(ref)
+        probs.append(ref.get_prob([0], [result]))
+        ref.mid_measure([0], [result])
+        if result:
+            ref.X(0)
+    return probs, ref.to_numpy()[:4]
+
+
+def test_shared_manager_matches_full_simulation():
+    results = [0, 1, 1, 0, 1]
+    seq = BDDSeqSim(3, 2, 2)
+    assert seq.comb_bdd.BDD is seq.stored_bdd.BDD is seq.input_bdd.BDD
+    seq.init_stored_state_by_basis(0)
+    for result in results:
+        seq.init_input_state_by_basis(0)
+        seq.init_comb_bdd()
+        body(seq)
+        seq.measure([result])
+    probs, stored = reference_run(results)
+    assert np.allclose(seq.prob_list, probs)
+    assert np.allclose(seq.stored_bdd.to_numpy(), stored)
+    assert np.isclose(seq.get_step_prob(), probs[-1] / probs[-2])
+    # An outside manager is used as is, e.g. a simulator kernel's
+    outer = BDDCombSim(3, 2)
+    assert BDDSeqSim(3, 2, 2, manager=outer.BDD).stored_bdd.BDD is outer.BDD
+
+
+
+def iterate(seq, results):
+    for result in results:
+        seq.init_input_state_by_basis(0)
+        seq.init_comb_bdd()
+        body(seq)
+        seq.measure([result])
+
+
+def test_operator_power_matches_iteration():
+    for result, power in ((0, 1), (0, 6), (1, 5), (1, 8)):
+        plain = BDDSeqSim(3, 2, 2)
+        plain.init_stored_state_by_basis(1)
+        iterate(plain, [result] * power)
+        fast = BDDSeqSim(3, 2, 2)
+        fast.init_stored_state_by_basis(1)
+        op = fast.body_operator(body, [result])
+        assert fast.prob_list == []
+        fast.apply_operator(op, power)
+        assert np.isclose(fast.prob_list[-1], plain.prob_list[-1])
+        assert np.allclose(fast.stored_bdd.to_numpy(), plain.stored_bdd.to_numpy())
+        # op^power as one operator, applied once
+        once = BDDSeqSim(3, 2, 2)
+        once.init_stored_state_by_basis(1)
+        once.apply_operator(once.operator_power(once.body_operator(body, [result]), power))
+        assert np.allclose(once.stored_bdd.to_numpy(), plain.stored_bdd.to_numpy())
+
+
+def test_symbolic_outcomes_match_fixed_sequences():
+    steps = 3
+    seq = BDDSeqSim(3, 2, 2)
+    seq.init_stored_state_by_basis(0)
+    for _ in range(steps):
+        seq.init_input_state_by_basis(0)
+        seq.init_comb_bdd()
+        body(seq)
+        seq.measure_symbolic()
+    assert seq.prob_list == []
+    dist = seq.sequence_distribution()
+    assert np.isclose(sum(dist.values()), 1.0)
+    for results in itertools.product((0, 1), repeat=steps):
+        plain = BDDSeqSim(3, 2, 2)
+        plain.init_stored_state_by_basis(0)
+        iterate(plain, results)
+        sequence = tuple((b,) for b in results)
+        assert np.isclose(seq.sequence_prob(sequence), plain.prob_list[-1])
+        assert np.isclose(dist.get(sequence, 0.0), plain.prob_list[-1])
+    # A prefix sums over the later outcomes; a predicate over the outcome variables
+    first_one = seq.sequence_prob([(1,)])
+    assert np.isclose(first_one, sum(p for s, p in dist.items() if s[0] == (1,)))
+    assert np.isclose(seq.predicate_prob(seq.outcome_var(0)), first_one)
+
+
+def test_general_input_state_matches_gate_preparation():
+    # The body's first gates on the input qubit, prepared once as the input state instead
+    def rest(sim):
+        sim.CNOT(0, 1)
+        sim.H(2)
+        sim.Toffoli(0, 2, 1)
+        sim.H(0)
+
+    # H|0> has only Fd[0] set (the conjunction path), TH|0> needs the general product
+    for prep in (['H'], ['H', 'T']):
+        state = BDDCombSim(1, 2)
+        state.init_basis_state(0)
+        for name in prep:
+            getattr(state, name)(0)
+        plain, general = BDDSeqSim(3, 2, 2), BDDSeqSim(3, 2, 2)
+        plain.init_stored_state_by_basis(2)
+        general.init_stored_state_by_basis(2)
+        for result in (1, 0, 1):
+            plain.init_input_state_by_basis(0)
+            plain.init_comb_bdd()
+            for name in prep:
+                getattr(plain, name)(0)
+            rest(plain)
+            plain.measure([result])
+            general.init_input_state_by_bdd(state)
+            general.init_comb_bdd()
+            rest(general)
+            general.measure([result])
+        assert np.allclose(general.prob_list, plain.prob_list)
+        assert np.allclose(general.stored_bdd.to_numpy(), plain.stored_bdd.to_numpy())
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"{name}: OK")
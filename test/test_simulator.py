@@ -0,0 +1,310 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
+import io
+import random
+import contextlib
+import numpy as np
+from src.parser import QiskitParser
+from src.simulator import BDDSimulator
+
+
+def run_quiet(sim, **kwargs):
+    # The simulator reports progress on stdout; keep the test output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sim.run(**kwargs)
+
+
+def rus_structure():
+    from exp.simulation.rus.rus_1 import circ
+    return QiskitParser(circ).parse()
+
+
+def test_loop_cycle_jump_matches_iteration():
+    # 30 failed trials then success: the jumped run skips 28 cycles and must agree with plain iteration
+    structure = rus_structure()
+    presets = [1] * 30 + [0]
+    jumped = BDDSimulator(structure)
+    plain = BDDSimulator(structure)
+    plain.detect_loop_cycles = False
+    run_quiet(jumped, mode="preset", presets={0: list(presets)})
+    run_quiet(plain, mode="preset", presets={0: list(presets)})
+    assert jumped.loop_cycles and jumped.loop_cycles[0]['skipped'] > 0
+    assert not plain.loop_cycles
+    assert jumped.loop_iterations == plain.loop_iterations
+    assert np.isclose(jumped.global_probability, plain.global_probability, rtol=1e-9, atol=0)
+    v, w = jumped.state_vector(), plain.state_vector()
+    assert np.isclose(np.vdot(v, v).real, 1.0)
+    # Equal up to a global phase
+    assert np.isclose(abs(np.vdot(v, w)), 1.0)
+    assert np.allclose(np.abs(v), np.abs(w))
+
+
+def test_loop_cycle_history_bound():
+    # Without any kept boundary state nothing is skipped, and the result is the plain one
+    structure = rus_structure()
+    bounded = BDDSimulator(structure)
+    bounded.loop_cycle_history = 0
+    default = BDDSimulator(structure)
+    run_quiet(bounded, mode="preset", presets={0: [1] * 5 + [0]})
+    run_quiet(default, mode="preset", presets={0: [1] * 5 + [0]})
+    assert not bounded.loop_cycles and default.loop_cycles
+    assert np.isclose(bounded.global_probability, default.global_probability, rtol=1e-9, atol=0)
+
+
+def branching_structure():
+    from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+    q = QuantumRegister(2, 'q')
+    c = ClassicalRegister(2, 'c')
+    qc = QuantumCircuit(q, c)
+    qc.h(q[0])
+    qc.measure(q[0], c[0])
+    with qc.if_test((c[0], 1)):
+        qc.h(q[1])
+    qc.measure(q[1], c[1])
+    return QiskitParser(qc).parse()
+
+
+def test_deferred_state_views_raise():
+    sim = BDDSimulator(branching_structure())
+    run_quiet(sim, mode="deferred")
+    assert sim.kernel.outcome_vars
+    for view in (sim.state_vector, sim.kernel.to_numpy, lambda: list(sim.kernel.iter_nonzero()),
+                 sim.kernel.export_node_table, lambda: sim.kernel.get_amplitudes([0])):
+        try:
+            view()
+        except ValueError as e:
+            assert "deferred" in str(e)
+        else:
+            raise AssertionError("a basis-state view of a deferred state did not raise")
+
+
+def test_deferred_break_raises_value_error():
+    from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+    q = QuantumRegister(1, 'q')
+    c = ClassicalRegister(1, 'c')
+    qc = QuantumCircuit(q, c)
+    qc.h(q[0])
+    qc.measure(q[0], c[0])
+    with qc.while_loop((c[0], 1)):
+        qc.h(q[0])
+        qc.measure(q[0], c[0])
+        qc.break_loop()
+    sim = BDDSimulator(QiskitParser(qc).parse())
+    try:
+        run_quiet(sim, mode="deferred")
+    except ValueError as e:
+        assert "break" in str(e)
+    else:
+        raise AssertionError("break in deferred mode did not raise")
+
+
+def final_measurement_structure():
+    # Nonuniform outcome distribution, every measurement at the end
+    from qiskit import QuantumCircuit
+    qc = QuantumCircuit(3, 3)
+    qc.h(0)
+    qc.t(0)
+    qc.h(0)
+    qc.cx(0, 1)
+    qc.h(2)
+    qc.t(2)
+    qc.cx(2, 1)
+    qc.h(2)
+    qc.measure([0, 1, 2], [0, 1, 2])
+    return QiskitParser(qc).parse()
+
+
+def test_final_measurement_shots_match_exact():
+    random.seed(11)
+    shots = 4000
+    sim = BDDSimulator(final_measurement_structure())
+    exact = {bits: p for (bits, _), p in run_quiet(sim, mode="explore").items()}
+    counts = run_quiet(sim, mode="preset", shots=shots)
+    assert sum(counts.values()) == shots and set(counts) <= set(exact)
+    for bits, p in exact.items():
+        assert abs(counts.get(bits, 0) - shots * p) <= 5 * np.sqrt(shots * p * (1 - p)) + 1e-9
+
+
+def test_split_shots_match_exact():
+    # Sample mode with a mid-circuit measurement: one simulation per outcome branch, not per shot
+    random.seed(12)
+    shots = 4000
+    sim = BDDSimulator(branching_structure())
+    exact = {bits: p for (bits, _), p in run_quiet(sim, mode="explore").items()}
+    counts = run_quiet(sim, mode="sample", shots=shots)
+    assert sim.num_branches == 2
+    assert sum(counts.values()) == shots and set(counts) <= set(exact)
+    for bits, p in exact.items():
+        assert abs(counts.get(bits, 0) - shots * p) <= 5 * np.sqrt(shots * p * (1 - p)) + 1e-9
+    # A loop: every shot is accounted for, over few distinct branches
+    sim = BDDSimulator(rus_structure())
+    counts = run_quiet(sim, mode="sample", shots=shots)
+    assert sum(counts.values()) == shots and sim.num_branches < 40
+
+
+def test_state_cache_matches_uncached_runs():
+    # A preset sweep sharing outcome prefixes, with a large and a tiny (evicting) cache
+    structure = rus_structure()
+    sweep = [[1] * t + [0] for t in (3, 1, 4, 2, 4, 0)]
+    plain = BDDSimulator(structure)
+    for cache_size in (64, 2):
+        cached = BDDSimulator(structure, cache_size=cache_size)
+        for presets in sweep:
+            run_quiet(plain, mode="preset", presets={0: list(presets)})
+            run_quiet(cached, mode="preset", presets={0: list(presets)})
+            assert cached.loop_iterations == plain.loop_iterations
+            assert np.isclose(cached.global_probability, plain.global_probability, rtol=1e-9, atol=0)
+            assert np.isclose(abs(np.vdot(cached.state_vector(), plain.state_vector())), 1.0)
+        assert 0 < len(cached.cache._lru) <= cache_size
+
+
+def test_snapshot_restore_and_fork():
+    sim = BDDSimulator(branching_structure())
+    run_quiet(sim, mode="preset", presets={0: [1]})
+    state = sim.snapshot()
+    vec, store, prob = sim.state_vector(), dict(sim.clbit_store), sim.global_probability
+    # A fork evolves on its own
+    twin = sim.fork()
+    twin.kernel.H(0)
+    twin.kernel.mid_measure([0], [0])
+    twin.clbit_store[0] = 0
+    twin.global_probability *= 0.5
+    assert np.allclose(sim.state_vector(), vec) and sim.clbit_store == store
+    # Changes after the snapshot are undone by restore
+    sim.kernel.X(1)
+    sim.kernel.T(1)
+    sim.clbit_store[1] = 1 - store[1]
+    sim.global_probability = 0.1
+    sim.restore(state)
+    assert np.allclose(sim.state_vector(), vec)
+    assert sim.clbit_store == store and sim.global_probability == prob
+    # The fork's changes are the ones the plain kernel gives
+    sim.kernel.H(0)
+    sim.kernel.mid_measure([0], [0])
+    assert np.allclose(twin.state_vector(), sim.state_vector())
+
+
+def test_explore_matches_preset_paths():
+    # Every explored path against the preset run of its outcomes
+    sim = BDDSimulator(branching_structure())
+    explored = run_quiet(sim, mode="explore")
+    assert np.isclose(sum(explored.values()), 1.0) and sim.pruned_probability == 0.0
+    for (bits, _), p in explored.items():
+        run_quiet(sim, mode="preset", presets={0: [int(bits[-1])]})
+        final = sim.kernel.get_prob([1], [int(bits[-2])]) / sim.kernel.get_norm()
+        assert np.isclose(sim.global_probability * final, p)
+    # Loop paths are told apart by their iteration counts; the tail below epsilon is pruned
+    sim = BDDSimulator(rus_structure())
+    explored = run_quiet(sim, mode="explore", epsilon=1e-6)
+    assert np.isclose(sum(explored.values()) + sim.pruned_probability, 1.0)
+    for (bits, iterations), p in explored.items():
+        run_quiet(sim, mode="preset", presets={0: [1] * iterations[0] + [0]})
+        assert sim.loop_iterations == list(iterations)
+        assert np.isclose(sim.global_probability, p, rtol=1e-9, atol=0)
+
+
+def test_loop_markov_chain_matches_iteration():
+    # The chain is built on loop entry (first trial failed); its queries against preset runs of each iteration count
+    structure = rus_structure()
+    sim = BDDSimulator(structure)
+    sim.markov_max_internal = 2
+    run_quiet(sim, mode="preset", presets={0: [1, 0]})
+    chain = sim.loop_chains[0]
+    assert chain.runs_body
+    plain = BDDSimulator(structure)
+    run_quiet(plain, mode="preset", presets={0: [0]})
+    entry = 1.0 - plain.global_probability
+    probs, exit_rho = [0.0], 0
+    for k in range(1, 30):
+        run_quiet(plain, mode="preset", presets={0: [1] * k + [0]})
+        probs.append(plain.global_probability / entry)
+        v = plain.state_vector()
+        exit_rho = exit_rho + probs[-1] * np.outer(v, v.conj())
+    assert np.allclose(chain.iteration_distribution(29), probs)
+    assert np.isclose(chain.termination_probability(), sum(probs))
+    assert np.isclose(chain.expected_iterations(), sum(k * p for k, p in enumerate(probs)))
+    assert np.allclose(chain.exit_state(), exit_rho)
+
+
+def test_input_family_matches_individual_runs():
+    # One symbolic run for all four inputs against one run per input, along the same preset path
+    structure = rus_structure()
+    presets = [1, 1, 0]
+    family = BDDSimulator(structure)
+    family.set_input_family([0, 1])
+    run_quiet(family, mode="preset", presets={0: list(presets)})
+    for value in range(4):
+        single = BDDSimulator(structure)
+        single.kernel.init_basis_state(value)
+        single.initial_state = single.kernel.snapshot()
+        run_quiet(single, mode="preset", presets={0: list(presets)})
+        assert single.loop_iterations == family.loop_iterations
+        assert np.isclose(family.input_probability(value), single.kernel.get_norm())
+        assert np.allclose(family.input_state(value).to_numpy(), single.kernel.to_numpy())
+
+
+def test_sequential_sqc_matches_generic_loop():
+    structure = rus_structure()
+    for presets in ([1] * 6 + [0], [1, 0], [0]):
+        seq = BDDSimulator(structure)
+        seq.sequential_sqc = True
+        generic = BDDSimulator(structure)
+        generic.detect_loop_cycles = False
+        run_quiet(seq, mode="preset", presets={0: list(presets)})
+        run_quiet(generic, mode="preset", presets={0: list(presets)})
+        # The engine is used whenever the loop is entered
+        assert len(seq.loop_prob_lists) == presets[0] and not generic.loop_prob_lists
+        assert seq.loop_iterations == generic.loop_iterations
+        assert seq.clbit_store == generic.clbit_store
+        assert np.isclose(seq.global_probability, generic.global_probability, rtol=1e-9, atol=0)
+        assert np.allclose(seq.state_vector(), generic.state_vector())
+
+
+def marginal(explored):
+    dist = {}
+    for (bits, _), p in explored.items():
+        dist[bits] = dist.get(bits, 0.0) + p
+    return dist
+
+
+def test_deferred_matches_explore():
+    from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister
+    q = QuantumRegister(3, 'q')
+    c = ClassicalRegister(3, 'c')
+    qc = QuantumCircuit(q, c)
+    qc.h(q[0])
+    qc.t(q[0])
+    qc.h(q[0])
+    qc.cx(q[0], q[1])
+    qc.measure(q[0], c[0])
+    with qc.if_test((c[0], 1)) as else_:
+        qc.h(q[1])
+        qc.t(q[1])
+    with else_:
+        qc.h(q[2])
+    qc.measure(q[1], c[1])
+    with qc.if_test((c[1], 0)):
+        qc.cx(q[2], q[0])
+        qc.h(q[2])
+    qc.measure(q[2], c[2])
+    for structure in (branching_structure(), QiskitParser(qc).parse()):
+        sim = BDDSimulator(structure)
+        explored = marginal(run_quiet(sim, mode="explore"))
+        deferred = run_quiet(sim, mode="deferred")
+        assert set(deferred) == set(explored)
+        for bits, p in explored.items():
+            assert np.isclose(deferred[bits], p)
+    # A loop, pruned below the same epsilon in both modes
+    sim = BDDSimulator(rus_structure())
+    explored = marginal(run_quiet(sim, mode="explore", epsilon=1e-9))
+    deferred = run_quiet(sim, mode="deferred", epsilon=1e-9)
+    for bits, p in explored.items():
+        assert np.isclose(deferred[bits], p, atol=1e-8)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"{name}: OK")